@@ -1,35 +1,47 @@
 # ---- File: agents/market_research_agent.py ----
 
+import asyncio
+import copy
 import json
 import logging
-from typing import Dict, Any, Optional
+import sys
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Callable, Awaitable, List, Tuple
 
+import msgspec
 from pydantic import ValidationError, BaseModel
 
 # Import the generic LLM client and helper functions
-from llm_client import AIClient, clean_json_response, create_error_json
+from llm_client import AIClient, LLMStreamError, clean_json_response, create_error_json, is_error_json
+
+# Import the global settings instance
+from config import settings
+
+import semantic_cache
 
 # Import the specific schemas needed for this agent
-from schemas.market_research import CompetitiveAnalysis
+from schemas.market_research import (
+    CompetitiveAnalysis, CompetitiveAnalysisStruct,
+    SCHEMA_FILE, EXAMPLE_FILE, dump_competitive_analysis_schema,
+)
 
 logger = logging.getLogger(__name__)
 
 # --- Prompt Components ---
-# Ensure schema generation handles potential errors
+# Schema and example are read from the checked-in dumps (see schemas/market_research.py);
+# generating them through Pydantic is only the fallback if the files are missing.
 try:
-    # Generate schema as Dict, not just string for potential use later
-    competitive_analysis_schema: Dict[str, Any] = CompetitiveAnalysis.model_json_schema()
-    schema_json_str: str = json.dumps(competitive_analysis_schema, indent=2)
-    # Access examples safely with get() method
-    model_config = getattr(CompetitiveAnalysis, 'model_config', {})
-    json_schema_extra = model_config.get('json_schema_extra', {})
-    examples = json_schema_extra.get('examples', [{}])
-    example_json_str: str = json.dumps(examples[0] if examples else {}, indent=2)
-except Exception as e:
-    logger.exception("Failed to generate schema/example JSON for Market Research Agent prompt.")
-    schema_json_str = '{ "error": "schema generation failed" }'
-    example_json_str = '{ "error": "example generation failed" }'
-    competitive_analysis_schema = {} # Default empty schema
+    schema_json_str: str = SCHEMA_FILE.read_text(encoding="utf-8").rstrip("\n")
+    example_json_str: str = EXAMPLE_FILE.read_text(encoding="utf-8").rstrip("\n")
+except OSError:
+    logger.warning("Pre-dumped schema files not found, generating the prompt schema with Pydantic.")
+    try:
+        schema_json_str, example_json_str = dump_competitive_analysis_schema()
+    except Exception as e:
+        logger.exception("Failed to generate schema/example JSON for Market Research Agent prompt.")
+        schema_json_str = '{ "error": "schema generation failed" }'
+        example_json_str = '{ "error": "example generation failed" }'
 
 
 CORE_SYSTEM_INSTRUCTION = """You are a Competitive Analysis Agent specialized in market research and competitor analysis. Your task is to analyze the user's query and provide structured insights about competitors and market trends. Provide factual information and strategic recommendations. CRITICAL INSTRUCTION: You MUST respond ONLY with a valid JSON object that strictly adheres to the provided Pydantic schema. Do NOT include any introductory text, explanations, apologies, or markdown formatting (like ``` ... ```) around the JSON object. Your entire response must be the JSON object itself."""
@@ -41,100 +53,252 @@ Here is an example of the exact JSON format required:
 {example_json_str}
 
 Analyze the user query below and return ONLY the valid JSON object matching the schema.
-User Query: {{user_query}}"""
-FULL_USER_PROMPT_TEMPLATE = SCHEMA_GUIDANCE
+User Query: """
+# Schema, example and instructions are fixed; the query is simply appended to this single prefix
+USER_PROMPT_PREFIX: str = sys.intern(SCHEMA_GUIDANCE)
+
+# --- Shared Client ---
+# One AIClient per process: its URLs, headers and dispatch tables are built once, and all
+# calls go through the shared httpx connection pool in llm_client.
+_ai_client: Optional[AIClient] = None
+
+def get_ai_client() -> AIClient:
+    """Returns the process-wide AIClient, creating it on first use."""
+    global _ai_client
+    if _ai_client is None:
+        _ai_client = AIClient()
+    return _ai_client
+
+# --- Provider Dispatch ---
+# Maps the model key from the UI to the matching AIClient call.
+# Methods are resolved on the instance at call time so the client can be swapped or mocked.
+# LMStudio schema passing is disabled for now; it uses the standard json_object mode for broader compatibility.
+PROVIDER_CALLS: Dict[str, Callable[[AIClient, str, str], Awaitable[str]]] = {
+    "gemini": lambda client, system, prompt: client.call_gemini(system, prompt),
+    "lmstudio": lambda client, system, prompt: client.call_lmstudio(system, prompt, json_schema=None),
+    "ollama": lambda client, system, prompt: client.call_ollama(system, prompt),
+}
+
+# Receives response text deltas as they arrive when an analysis is streamed
+TokenCallback = Callable[[str], None]
+
+async def _stream_provider(client: AIClient, model: str, system: str, prompt: str, on_token: TokenCallback) -> str:
+    """
+    Streams the provider response, forwarding each delta; returns the full text (or error JSON like call_*).
+    If the provider rejects streaming before sending anything, falls back to the regular call and
+    forwards its whole response as a single delta.
+    """
+    parts: List[str] = []
+    try:
+        async for chunk in client.stream_chat(model, system, prompt):
+            parts.append(chunk)
+            on_token(chunk)
+    except LLMStreamError as e:
+        call_provider = PROVIDER_CALLS.get(model)
+        if parts or not e.stream_only or call_provider is None:
+            return e.to_error_json()
+        logger.warning("Streaming failed for %s (%s), retrying without streaming.", model, e.message)
+        raw_response = await call_provider(client, system, prompt)
+        if not is_error_json(raw_response):
+            on_token(raw_response)
+        return raw_response
+    return "".join(parts)
+
+# --- Response Cache ---
+# In-process LRU of results keyed on (model, normalized query). Successful results live for
+# response_cache_ttl_seconds; errors only for error_cache_ttl_seconds, so repeated submits while a
+# provider is down don't each wait on it, yet a retry shortly after it recovers goes through.
+# This exact-match tier is checked before the (slower) semantic cache and the LLM.
+# Entries are (monotonic expiry time, result encoded as JSON bytes): a hit is a single msgspec decode
+# (no Pydantic revalidation, no deepcopy) and always yields a fresh dict the caller may mutate.
+_response_cache: "OrderedDict[Tuple[str, str], Tuple[float, bytes]]" = OrderedDict()
+
+def _normalize_query(query: str) -> str:
+    """Collapses whitespace and lowercases so trivially different queries share a cache entry."""
+    return " ".join(query.split()).lower()
+
+def clear_response_cache() -> None:
+    """Drops all cached analysis results."""
+    _response_cache.clear()
+
+def _store_cached_result(cache_key: Tuple[str, str], result: Dict[str, Any], ttl_seconds: float) -> None:
+    """Adds a result to the LRU cache, evicting the least recently used entry if full."""
+    if settings.response_cache_size <= 0 or ttl_seconds <= 0:
+        return
+    # enc_hook=str: Pydantic validation errors can carry exception objects in their "ctx"
+    _response_cache[cache_key] = (time.monotonic() + ttl_seconds, msgspec.json.encode(result, enc_hook=str))
+    if len(_response_cache) > settings.response_cache_size:
+        _response_cache.popitem(last=False) # Evict least recently used
+
+class _TokenFanout:
+    """Forwards the streamed deltas of one in-flight analysis to every caller sharing it.
+    Callers that join late first get the deltas they missed, so each sees the full text."""
+
+    def __init__(self) -> None:
+        self.seen: List[str] = []
+        self.listeners: List[TokenCallback] = []
+
+    def subscribe(self, on_token: TokenCallback) -> None:
+        for chunk in self.seen:
+            on_token(chunk)
+        self.listeners.append(on_token)
+
+    def __call__(self, chunk: str) -> None:
+        self.seen.append(chunk)
+        for on_token in self.listeners:
+            on_token(chunk)
+
+# Analyses currently running, keyed like the cache. Concurrent identical requests await the
+# same task instead of each calling the LLM ("single flight"). The fan-out is set when the
+# analysis streams (its first caller passed on_token); later streaming callers subscribe to it.
+_inflight_analyses: "Dict[Tuple[str, str], Tuple[asyncio.Task[Dict[str, Any]], Optional[_TokenFanout]]]" = {}
 
 
 # Add specific return type hint: Dict[str, Any]
-async def analyze_competition(query: str, model: str) -> Dict[str, Any]:
+async def analyze_competition(query: str, model: str, on_token: Optional[TokenCallback] = None) -> Dict[str, Any]:
     """
     Performs competitive analysis using the selected LLM.
     Returns a dictionary containing results or error information.
+    Results are served from the LRU cache when possible, and identical concurrent requests share one LLM call.
+    If on_token is given, the response is streamed and each text delta is passed to it as it arrives
+    (cache hits, and callers joining an in-flight analysis that is not streaming, only get the final result).
     """
-    # ... implementation ...
-    logger.info(f"Market Research Agent: Starting analysis with model: {model}, query: {query[:50]}...")
-    ai_client = AIClient()
+    logger.info("Market Research Agent: Starting analysis with model: %s, query: %.50s...", model, query)
+    cache_key = (model, _normalize_query(query))
+    cached_entry = _response_cache.get(cache_key)
+    if cached_entry is not None:
+        expires_at, cached_result = cached_entry
+        if time.monotonic() <= expires_at:
+            _response_cache.move_to_end(cache_key)
+            logger.info("Market Research Agent: Cache hit for model %s.", model)
+            cached: Dict[str, Any] = msgspec.json.decode(cached_result)
+            return cached
+        del _response_cache[cache_key] # Expired
+
+    inflight = _inflight_analyses.get(cache_key)
+    if inflight is None:
+        fanout = _TokenFanout() if on_token is not None else None
+        task = asyncio.create_task(_analyze_competition_uncached(query, model, cache_key, fanout))
+        _inflight_analyses[cache_key] = (task, fanout)
+        task.add_done_callback(lambda _: _inflight_analyses.pop(cache_key, None))
+    else:
+        task, fanout = inflight
+        logger.info("Market Research Agent: Joining in-flight analysis for model %s.", model)
+    if fanout is not None and on_token is not None:
+        fanout.subscribe(on_token)
+    # Shielded so one caller disconnecting does not cancel the call for the others
+    result = await asyncio.shield(task)
+    return copy.deepcopy(result) # Each caller gets its own copy of the shared result
+
+
+async def _analyze_competition_uncached(query: str, model: str, cache_key: Tuple[str, str],
+                                        on_token: Optional[TokenCallback] = None) -> Dict[str, Any]:
+    """Calls the LLM, validates the response, and stores successful results in the cache."""
+    # Second tier: a paraphrase of an earlier query may already be answered in Redis
+    semantic_hit = await semantic_cache.lookup(query, model)
+    if semantic_hit is not None:
+        _store_cached_result(cache_key, semantic_hit, settings.response_cache_ttl_seconds)
+        return semantic_hit
+
+    ai_client = get_ai_client()
     system_instruction = CORE_SYSTEM_INSTRUCTION
-    user_prompt_content = FULL_USER_PROMPT_TEMPLATE.replace("{{user_query}}", query)
+    user_prompt_content = USER_PROMPT_PREFIX + query
 
     raw_response: str = ""
     structured_result: Optional[Dict[str, Any]] = None
     error_result: Optional[Dict[str, Any]] = None
 
     try:
-        # Determine schema usage based on model type (Example for LMStudio)
-        schema_to_pass: Optional[Dict[str, Any]] = None
-        if model == "lmstudio":
-            # Pass the schema dict if using LMStudio and it supports it
-            # schema_to_pass = competitive_analysis_schema # Disabled for now, using standard json_object mode
-            pass # Keep using standard json_object mode for broader compatibility
-
-
         # Call the appropriate LLM provider via the client
-        if model == "gemini":
-            raw_response = await ai_client.call_gemini(system_instruction, user_prompt_content)
-        elif model == "lmstudio":
-             # Pass schema if needed, otherwise None
-             raw_response = await ai_client.call_lmstudio(system_instruction, user_prompt_content, json_schema=schema_to_pass)
-        elif model == "ollama":
-            raw_response = await ai_client.call_ollama(system_instruction, user_prompt_content)
+        call_provider = PROVIDER_CALLS.get(model)
+        if call_provider is not None and on_token is not None:
+            raw_response = await _stream_provider(ai_client, model, system_instruction, user_prompt_content, on_token)
+        elif call_provider is not None:
+            raw_response = await call_provider(ai_client, system_instruction, user_prompt_content)
         else:
-            logger.error(f"Market Research Agent: Invalid model requested: {model}")
+            logger.error("Market Research Agent: Invalid model requested: %s", model)
             error_result = {"error": f"Invalid model selected for agent: {model}"}
 
         # Process the response if no error during model selection/call initiation
         if error_result is None:
-            logger.info(f"Market Research Agent: Raw response received from {model} (length: {len(raw_response)})")
+            logger.info("Market Research Agent: Raw response received from %s (length: %d)", model, len(raw_response))
             cleaned_response = clean_json_response(raw_response)
 
             if not cleaned_response: # Handle empty cleaned response
-                 logger.error(f"Market Research Agent: Received empty response from {model} after cleaning.")
+                 logger.error("Market Research Agent: Received empty response from %s after cleaning.", model)
                  error_result = {"error": f"LLM {model} returned an empty response.", "raw": raw_response}
             else:
-                try:
-                    # Check if it's an error object returned by the client
-                    potential_error = json.loads(cleaned_response)
-                    if isinstance(potential_error, dict) and "error" in potential_error:
-                        logger.error(f"Market Research Agent: LLM client returned an error for {model}: {potential_error}")
-                        error_result = {"error": f"LLM call failed: {potential_error.get('error', 'Unknown error')}", "details": potential_error.get('details'), "raw": raw_response}
-                except json.JSONDecodeError:
-                     # Expected path if the response IS the valid JSON data
-                     pass # Proceed to Pydantic validation
-                except Exception as e:
-                     logger.warning(f"Market Research Agent: Could not peek into raw response from {model}: {e}")
-                     pass # Proceed anyway
-
-                # --- If not an error object, validate with Pydantic ---
+                # Check if it's an error object returned by the client (prefix check avoids parsing normal responses twice)
+                if is_error_json(cleaned_response):
+                    try:
+                        potential_error = msgspec.json.decode(cleaned_response)
+                        if isinstance(potential_error, dict) and "error" in potential_error:
+                            logger.error("Market Research Agent: LLM client returned an error for %s: %s", model, potential_error)
+                            error_result = {"error": f"LLM call failed: {potential_error.get('error', 'Unknown error')}", "details": potential_error.get('details'), "raw": raw_response}
+                    except msgspec.DecodeError as e:
+                        logger.warning("Market Research Agent: Could not peek into raw response from %s: %s", model, e)
+                        pass # Proceed to validation anyway
+
+                # --- If not an error object, validate (msgspec fast path) ---
                 if error_result is None:
+                    try:
+                        fast_analysis = msgspec.json.decode(cleaned_response, type=CompetitiveAnalysisStruct)
+                        logger.info("Market Research Agent: Successfully validated response from %s.", model)
+                        structured_result = {
+                            "structured": msgspec.to_builtins(fast_analysis),
+                            "raw": raw_response
+                        }
+                    except (msgspec.ValidationError, msgspec.DecodeError):
+                        pass # Fall through to Pydantic for detailed error reporting
+
+                # --- Slow path: Pydantic validation produces the detailed errors shown to the user ---
+                if error_result is None and structured_result is None:
                     try:
                         # Use the imported CompetitiveAnalysis model for validation
                         analysis: CompetitiveAnalysis = CompetitiveAnalysis.model_validate_json(cleaned_response)
-                        logger.info(f"Market Research Agent: Successfully validated response from {model}.")
+                        logger.info("Market Research Agent: Successfully validated response from %s.", model)
                         structured_result = {
                             "structured": analysis.model_dump(mode='json'),
                             "raw": raw_response
                         }
                     except ValidationError as e:
-                        logger.error(f"Market Research Agent: Pydantic validation failed for {model}: {e}", exc_info=False)
-                        logger.error(f"Cleaned response snippet: {cleaned_response[:1000]}...")
+                        logger.error("Market Research Agent: Pydantic validation failed for %s: %s", model, e, exc_info=False)
+                        logger.error("Cleaned response snippet: %.1000s...", cleaned_response)
                         error_result = {
                             "error": f"Response from {model} did not match expected structure.",
                             "raw": raw_response,
                             "validation_errors": e.errors()
                         }
                     except json.JSONDecodeError as e:
-                        logger.error(f"Market Research Agent: Failed to decode cleaned JSON from {model}: {e}", exc_info=False)
-                        logger.error(f"Cleaned response snippet: {cleaned_response[:1000]}...")
+                        logger.error("Market Research Agent: Failed to decode cleaned JSON from %s: %s", model, e, exc_info=False)
+                        logger.error("Cleaned response snippet: %.1000s...", cleaned_response)
                         error_result = {"error": f"LLM {model} returned invalid JSON", "raw": raw_response}
 
     except Exception as e:
-        logger.exception(f"Market Research Agent: Unexpected error during analysis for model {model}: {e}")
+        logger.exception("Market Research Agent: Unexpected error during analysis for model %s: %s", model, e)
         # Ensure raw_response is included if available
         error_result = {
             "error": f"An unexpected application error occurred in the agent: {str(e)}",
             "raw": raw_response if raw_response else "Raw response not available"
         }
 
+    if structured_result is not None:
+        _store_cached_result(cache_key, structured_result, settings.response_cache_ttl_seconds)
+        await semantic_cache.store(query, model, structured_result)
+        return structured_result
+
     # Return final result, ensure a dict is always returned
-    final_result = structured_result if structured_result is not None else (error_result if error_result is not None else {"error": "Unknown state in Market Research Agent", "raw": raw_response if raw_response else "N/A"})
-    return final_result
\ No newline at end of file
+    final_result = error_result if error_result is not None else {"error": "Unknown state in Market Research Agent", "raw": raw_response if raw_response else "N/A"}
+    _store_cached_result(cache_key, final_result, settings.error_cache_ttl_seconds)
+    return final_result
+
+
+async def analyze_competition_many(query: str, models: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Runs the same analysis against several models concurrently.
+    Returns a dictionary mapping each model to its analyze_competition result.
+    Per-provider concurrency is bounded inside AIClient.
+    """
+    unique_models = list(dict.fromkeys(models)) # Preserve order, drop duplicates
+    results = await asyncio.gather(*(analyze_competition(query, model) for model in unique_models))
+    return dict(zip(unique_models, results))
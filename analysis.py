@@ -2,170 +2,348 @@
 
 from fasthtml.common import *
 # Import specific components from fasthtml.components
-from fasthtml.components import Script, Group, Pre
+from fasthtml.components import Group, Pre
 
 from starlette.requests import Request
-from starlette.responses import HTMLResponse # Import directly if needed, though Group handles it
-from fastapi import Depends
-import json
+import msgspec
 import logging
 import asyncio
-from typing import Any, Dict, List, Optional # Import needed types
+import functools
+import secrets
+from html import escape
+import os
+from jinja2 import Environment, FileSystemLoader
+from typing import Any, Callable, Dict, List, Optional, Tuple # Import needed types
 
 from agents.market_research_agent import analyze_competition as analyze_market_competition
-from utils import get_user
+from utils import session_user, unauthorized_response
 
 logger = logging.getLogger(__name__)
 
+# --- Models ---
+# (value, label) in display order; VALID_MODELS is the O(1) membership check for form input
+MODEL_OPTIONS: Tuple[Tuple[str, str], ...] = (("ollama", "Ollama (Local)"), ("lmstudio", "LMStudio (Local)"), ("gemini", "Gemini (Cloud)"))
+VALID_MODELS: frozenset = frozenset(value for value, _ in MODEL_OPTIONS)
+MODEL_LABELS: Dict[str, str] = dict(MODEL_OPTIONS)
+
+# --- Background Analysis Tasks ---
+# /analyze starts the (slow) LLM call exactly once; the browser then waits for the
+# finished result on an SSE stream instead of re-POSTing on a timer.
+ANALYSIS_TASK_TTL_SECONDS = 300 # Unclaimed results are dropped after this long
+# task id -> (analysis task, model, queue of streamed response text; None marks the end)
+ANALYSIS_TASKS: Dict[str, Tuple["asyncio.Task[Dict[str, Any]]", str, "asyncio.Queue[Optional[str]]"]] = {}
+
+async def run_analysis(q: str, model: str, on_token: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    """Runs the agent for a query, never raising. Returns the agent result dict (structured or error).
+    If on_token is given, the LLM response is streamed to it as it is generated."""
+    if q.lower().startswith("test:"):
+        # Static data, deliberately not run through the Pydantic/msgspec models: nothing to validate
+        logger.info("Test query detected, returning static response")
+        return {
+             "structured": {"summary": "Static test response.", "competitors": [], "market_trends": [], "recommendations": ["Use real queries."]},
+             "raw": "Test Query Processed"
+        }
+    try:
+        logger.info("Executing analysis: model=%s, query='%.50s...'", model, q)
+        result_data = await analyze_market_competition(query=q, model=model, on_token=on_token)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Agent result processing complete for model %s. Keys: %s", model, list(result_data.keys()))
+        return result_data
+    except Exception as e:
+         logger.exception("Unexpected error calling agent for model %s: %s", model, e)
+         return {"error": f"An unexpected error occurred calling the agent: {str(e)}"}
+
+async def run_analysis_many(q: str, models: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Runs the analysis for several models concurrently (total latency is the slowest model, not the sum)."""
+    results = await asyncio.gather(*(run_analysis(q, model) for model in models))
+    return dict(zip(models, results))
+
+def start_analysis_task(q: str, model: str) -> str:
+    """Schedules run_analysis in the background and returns the id used to stream its progress and result."""
+    task_id = secrets.token_urlsafe(12)
+    tokens: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+
+    async def run_and_close_stream() -> Dict[str, Any]:
+        try:
+            return await run_analysis(q, model, on_token=tokens.put_nowait)
+        finally:
+            tokens.put_nowait(None)
+
+    task = asyncio.create_task(run_and_close_stream())
+    ANALYSIS_TASKS[task_id] = (task, model, tokens)
+    # Drop results nobody picked up (e.g. the tab was closed)
+    asyncio.get_running_loop().call_later(ANALYSIS_TASK_TTL_SECONDS, ANALYSIS_TASKS.pop, task_id, None)
+    return task_id
+
 # --- Routes ---
 
+# Status lines pushed as "step" events while an analysis streams
+STEP_WAITING = "Waiting for the model to respond..."
+STEP_RECEIVING = "Receiving response..."
+STEP_VALIDATING = "Validating response..."
+
+# SSE comment sent while nothing else is (e.g. the model is still loading or queued), so proxies and
+# browsers don't drop the connection as idle; EventSource ignores comment lines
+SSE_KEEPALIVE_SECONDS = 15.0
+SSE_KEEPALIVE = ": keepalive\n\n"
+
+def sse_token_message(text: str) -> str:
+    """SSE "token" event carrying raw response text. Unlike sse_message, keeps blank lines and trailing newlines."""
+    data = "".join(f"data: {line}\n" for line in escape(text, quote=False).split("\n"))
+    return f"event: token\n{data}\n"
+
 # Type hint: Route functions in FastAPI/Starlette often return Response types
 # FastHTML components render to Response implicitly, so 'Any' or 'HTMLResponse' could work.
 # Using 'Any' for flexibility with FastHTML components.
-def add_analysis_routes(rt, get_user):
+def add_analysis_routes(rt):
     @rt('/analyze', methods=['POST'])
-    async def analyze(r: Request, email: str = Depends(get_user)) -> Any:
+    async def analyze(r: Request) -> Any:
+        email = session_user(r)
+        if email is None:
+            return unauthorized_response()
         # Get form data manually
         form_data = await r.form()
         q = form_data.get("q", "")
         model = form_data.get("model", "ollama")
         
         r.session['selected_llm'] = model
-        logger.info(f"Analyze POST request received: model={model}, query='{q[:50]}...' by user {email}")
-        valid_models = ["gemini", "ollama", "lmstudio"]
-        if model not in valid_models:
-             logger.warning(f"Invalid model '{model}' selected in form.")
+        logger.info("Analyze POST request received: model=%s, query='%.50s...' by user %s", model, q, email)
+        if model not in VALID_MODELS:
+             logger.warning("Invalid model '%s' selected in form.", model)
              pass # Allow agent to handle for now
 
-        loading_html = Div(
-            H3("Analysis in Progress...", cls="text-xl font-bold mb-3 text-blue-600"),
-            Div(
-                Div(cls="animate-pulse h-2 bg-blue-200 rounded w-full mb-4"),
-                P(f"Contacting {model} model and processing query. Please wait...", cls="text-gray-700 font-medium mb-3"),
-                P("Results will appear below automatically.", cls="text-sm text-gray-500 mt-4"),
-                Div(
-                    hx_post="/analyze-result",
-                    hx_trigger="load delay:200ms, every 2s",
-                    hx_target="#resp",
-                    hx_swap="outerHTML",
-                    hx_vals=json.dumps({"q": q, "model": model}),
-                ),
-                cls="p-4 bg-white rounded-lg border border-blue-200"
-            ),
-            id="resp",
-            cls="p-4 bg-white rounded-lg shadow-md"
-        )
+        task_id = start_analysis_task(q, model)
+        loading_html = render_loading_panel(model, task_id)
         # Return both the loading HTML and the model selection radio buttons
         return Group(
             loading_html,
             render_model_selection_oob(model)
         )
 
+    @rt('/analyze-stream/{task_id}')
+    async def analyze_stream(r: Request, task_id: str) -> Any:
+        """SSE endpoint: streams the LLM response text as "token" events, then the rendered result as one "result" event.
+
+        No session check here: the task id is the credential. It is only handed out by the
+        authenticated /analyze, is unguessable (96 random bits) and expires.
+        The task stays registered until its result has been sent (or the TTL drops it), so the SSE
+        extension reconnecting after a dropped connection still gets the result.
+        """
+        entry = ANALYSIS_TASKS.get(task_id)
+
+        async def result_events():
+            if entry is None:
+                logger.warning("Analysis stream requested for unknown or expired task %s", task_id)
+                result_data: Dict[str, Any] = {"error": "This analysis is no longer available. Please submit the query again."}
+                model = r.session.get('selected_llm', 'ollama')
+            else:
+                task, model, tokens = entry
+                streamed = False
+                # A reconnect after an earlier connection drained the stream goes straight to the result
+                while not (task.done() and tokens.empty()):
+                    try:
+                        text = await asyncio.wait_for(tokens.get(), SSE_KEEPALIVE_SECONDS)
+                    except asyncio.TimeoutError:
+                        yield SSE_KEEPALIVE
+                        continue
+                    if text is None:
+                        break
+                    if not streamed:
+                        streamed = True
+                        yield sse_message(STEP_RECEIVING, event="step")
+                    yield sse_token_message(text)
+                if streamed:
+                    yield sse_message(STEP_VALIDATING, event="step")
+                result_data = await task
+            yield sse_message(render_analysis_result(result_data, model), event="result")
+            ANALYSIS_TASKS.pop(task_id, None)
+
+        return EventStream(result_events())
+
+    @rt('/analyze-all', methods=['POST'])
+    async def analyze_all(r: Request) -> Any:
+        """Runs the query against every model concurrently and returns the results side by side."""
+        email = session_user(r)
+        if email is None:
+            return unauthorized_response()
+        form_data = await r.form()
+        q = form_data.get("q", "")
+        logger.info("Analyze-all POST request received: query='%.50s...' by user %s", q, email)
+        return render_comparison_result(await run_analysis_many(q, [value for value, _ in MODEL_OPTIONS]))
+
     @rt('/analyze-result', methods=['POST'])
-    async def analyze_result(r: Request, email: str = Depends(get_user)) -> Any:
+    async def analyze_result(r: Request) -> Any:
+        """Non-streaming variant: runs the analysis in the request and returns the rendered result."""
+        if session_user(r) is None:
+            return unauthorized_response()
         # Get form data manually
         form_data = await r.form()
         q = form_data.get("q", "")
         model = form_data.get("model", "ollama")
+        result_data = await run_analysis(q, model)
+        return render_analysis_result(result_data, model)
+
+
+def build_loading_panel(model: str, task_id: str) -> Div:
+    """Builds the #resp loading state that opens the SSE stream for a background analysis."""
+    return Div(
+        H3("Analysis in Progress...", cls="text-xl font-bold mb-3 text-blue-600"),
+        Div(
+            Div(cls="animate-pulse h-2 bg-blue-200 rounded w-full mb-4"),
+            P(f"Contacting {model} model and processing query. Please wait...", cls="text-gray-700 font-medium mb-3"),
+            P("Results will appear below automatically.", cls="text-sm text-gray-500 mt-4"),
+            # Opens an SSE connection: "step" events update the status line, "token" events append the raw
+            # response as it is generated, the final "result" event replaces #resp (which also closes the stream)
+            Div(
+                P(STEP_WAITING, sse_swap="step", hx_target="this", hx_swap="innerHTML", cls="text-sm text-blue-700 mb-2"),
+                Pre(sse_swap="token", hx_target="this", hx_swap="beforeend",
+                    cls="whitespace-pre-wrap text-xs text-gray-500 max-h-48 overflow-y-auto"),
+                hx_ext="sse",
+                sse_connect=f"/analyze-stream/{task_id}",
+                sse_swap="result",
+                hx_target="#resp",
+                hx_swap="outerHTML",
+            ),
+            cls="p-4 bg-white rounded-lg border border-blue-200"
+        ),
+        id="resp",
+        cls="p-4 bg-white rounded-lg shadow-md"
+    )
+
+
+# Only task_id varies per request for a known model, so each variant is serialized once with a
+# placeholder (task ids are URL-safe base64, so plain substitution needs no escaping)
+_TASK_ID_PLACEHOLDER = "__TASK_ID__"
+_LOADING_TEMPLATES: Dict[str, str] = {model: to_xml(build_loading_panel(model, _TASK_ID_PLACEHOLDER)) for model in VALID_MODELS}
+
+def render_loading_panel(model: str, task_id: str) -> Any:
+    """Returns the loading state for a task, from the pre-rendered template when the model is known."""
+    template = _LOADING_TEMPLATES.get(model)
+    if template is None:
+        return build_loading_panel(model, task_id)
+    return NotStr(template.replace(_TASK_ID_PLACEHOLDER, task_id))
+
+
+def render_analysis_result(result_data: Optional[Dict[str, Any]], model: str) -> Group:
+    """Renders an agent result (structured or error) as the #resp panel plus the OOB radio buttons."""
+    return Group(
+        render_analysis_panel(result_data, id="resp"),
+        render_model_selection_oob(model)
+    )
+
+
+def pretty_json(obj: Any) -> str:
+    """Indented JSON for the error panel (msgspec's C encoder; unknown types such as exceptions in
+    Pydantic error contexts are rendered with str() instead of failing)."""
+    return msgspec.json.format(msgspec.json.encode(obj, enc_hook=str), indent=2).decode()
+
+
+def render_analysis_panel(result_data: Optional[Dict[str, Any]], **attrs: Any) -> Div:
+    """Renders one agent result (structured or error) as a panel; extra attrs (e.g. id) go on the outer Div."""
+    display_content = Div(
+             H3("Application Error", cls="text-xl font-bold mb-3 text-red-600"),
+             P("An unexpected error occurred before processing the response."),
+             cls="p-4 bg-white rounded-lg shadow-md text-red-800",
+             **attrs
+         )
+
+    # Add type hint for analysis dictionary
+    analysis: Optional[Dict[str, Any]] = None
+    if result_data and "structured" in result_data:
+        analysis = result_data["structured"]
+
+    if result_data and "error" in result_data:
+        get = result_data.get
+        details, raw, validation_errors = get("details"), get("raw"), get("validation_errors")
+        parts: List[str] = ["Error processing request: ", str(result_data["error"]), "\n"]
+        if details: parts += ("\nDetails: ", pretty_json(details))
+        elif raw: parts += ("\nRaw response snippet:\n", raw[:500], "...")
+        if validation_errors is not None: parts += ("\nValidation Details: ", pretty_json(validation_errors))
+        error_message = "".join(parts)
+
+        logger.warning("Displaying error to user: %.150s...", error_message)
         display_content = Div(
-                 H3("Application Error", cls="text-xl font-bold mb-3 text-red-600"),
-                 P("An unexpected error occurred before processing the response."),
-                 id="resp",
-                 cls="p-4 bg-white rounded-lg shadow-md text-red-800"
-             )
-        result_data: Optional[Dict[str, Any]] = None # Add type hint
-
-        if q.lower().startswith("test:"):
-            logger.info("Test query detected in analyze_result, returning static response")
-            await asyncio.sleep(1)
-            result_data = {
-                 "structured": {"summary": "Static test response.", "competitors": [], "market_trends": [], "recommendations": ["Use real queries."]},
-                 "raw": "Test Query Processed"
-            }
-        else:
-            try:
-                logger.info(f"Analyze-Result POST executing analysis: model={model}, query='{q[:50]}...'")
-                result_data = await analyze_market_competition(query=q, model=model)
-                logger.info(f"Agent result processing complete for model {model}. Keys: {result_data.keys()}")
-            except Exception as e:
-                 logger.exception(f"Unexpected error calling agent for model {model}: {e}")
-                 result_data = {"error": f"An unexpected error occurred calling the agent: {str(e)}"}
-
-        # Add type hint for analysis dictionary
-        analysis: Optional[Dict[str, Any]] = None
-        if result_data and "structured" in result_data:
-            analysis = result_data["structured"]
-
-        if result_data and "error" in result_data:
-            error_message = f"Error processing request: {result_data['error']}\n"
-            if "details" in result_data and result_data["details"]: error_message += f"\nDetails: {json.dumps(result_data['details'], indent=2)}"
-            elif "raw" in result_data and result_data["raw"]: error_message += f"\nRaw response snippet:\n{result_data['raw'][:500]}..."
-            if "validation_errors" in result_data: error_message += f"\nValidation Details: {json.dumps(result_data['validation_errors'], indent=2)}"
-
-            logger.warning(f"Displaying error to user: {error_message[:150]}...")
-            display_content = Div(
-                H3("Analysis Error", cls="text-xl font-bold mb-3 text-red-600"),
-                Pre(error_message, cls="whitespace-pre-wrap bg-red-50 p-4 rounded-lg border border-red-200 text-sm text-red-800"),
-                id="resp",
-                cls="p-4 bg-white rounded-lg shadow-md"
-            )
-        elif analysis is not None: # Check if analysis dict exists
-            # --- Formatting Logic ---
-            formatted_response = f"""SUMMARY:
-{analysis.get('summary', 'Summary not available')}
-
-COMPETITORS:
-{"".join([f'''
-{comp.get('name', 'Unknown Competitor')}
-- Market Share: {comp.get('market_share') or 'Not provided'}
-- Pricing: {comp.get('pricing') or 'Not provided'}
-- Strengths: {', '.join(comp.get('strengths', ['Not provided']))}
-- Weaknesses: {', '.join(comp.get('weaknesses', ['Not provided']))}
-- Key Features: {', '.join(comp.get('key_features', ['Not provided']))}
-''' for comp in analysis.get('competitors', [])])}
-
-MARKET TRENDS:
-{"".join([f'''
-{trend.get('trend', 'Market Trend')}
-- Impact: {trend.get('impact', 'Not provided')}
-{f'- Opportunity: {trend.get("opportunity")}' if trend.get('opportunity') else ''}
-{f'- Threat: {trend.get("threat")}' if trend.get('threat') else ''}
-''' for trend in analysis.get('market_trends', [])])}
-
-RECOMMENDATIONS:
-{"".join([f'- {r}' for r in analysis.get('recommendations', ['No specific recommendations provided'])])}
-"""
-            display_content = Div(
-                H3("Analysis Results", cls="text-xl font-bold mb-3"),
-                Pre(formatted_response, cls="whitespace-pre-wrap bg-gray-50 p-4 rounded-lg border border-gray-200 text-sm"),
-                id="resp",
-                cls="p-4 bg-white rounded-lg shadow-md"
+            H3("Analysis Error", cls="text-xl font-bold mb-3 text-red-600"),
+            Pre(error_message, cls="whitespace-pre-wrap bg-red-50 p-4 rounded-lg border border-red-200 text-sm text-red-800"),
+            cls="p-4 bg-white rounded-lg shadow-md",
+            **attrs
+        )
+    elif analysis is not None: # Check if analysis dict exists
+        display_content = Div(
+            H3("Analysis Results", cls="text-xl font-bold mb-3"),
+            render_analysis_sections_cached(analysis),
+            cls="p-4 bg-white rounded-lg shadow-md",
+            **attrs
+        )
+    # else case (result_data exists but no 'error' or 'structured') covered by initial assignment
+
+    return display_content
+
+
+def render_comparison_result(results: Dict[str, Dict[str, Any]]) -> Div:
+    """Renders one panel per model (in MODEL_OPTIONS order) as the #resp comparison view."""
+    return Div(
+        H3("Model Comparison", cls="text-xl font-bold mb-3"),
+        *(
+            Div(
+                H4(MODEL_LABELS.get(model, model), cls="text-lg font-semibold text-gray-700 mb-2"),
+                render_analysis_panel(result_data),
+                cls="mb-4"
             )
-        # else case (result_data exists but no 'error' or 'structured') covered by initial assignment
+            for model, result_data in results.items()
+        ),
+        id="resp",
+        cls="p-4 bg-white rounded-lg shadow-md"
+    )
+
+
+# Compiled once at import; autoescape keeps LLM-provided text from injecting markup
+_TEMPLATE_ENV = Environment(
+    loader=FileSystemLoader(os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")),
+    autoescape=True,
+)
+_ANALYSIS_SECTIONS_TEMPLATE = _TEMPLATE_ENV.get_template("analysis_sections.html")
+
+def render_analysis_sections(analysis: Dict[str, Any]) -> NotStr:
+    """Renders a structured analysis as HTML (summary, competitors, trends, recommendations)."""
+    return NotStr(_ANALYSIS_SECTIONS_TEMPLATE.render(analysis=analysis))
 
-        return Group(
-            display_content,
-            render_model_selection_oob(model)
-        )
 
+def render_analysis_sections_cached(analysis: Dict[str, Any]) -> NotStr:
+    """render_analysis_sections, memoized on the analysis content (cache hits and re-submits render identical results)."""
+    # Sorted-key encoding is a canonical, hashable key and is cheaper than rendering the template
+    return NotStr(_render_sections_html(msgspec.json.encode(analysis, order="sorted")))
+
+
+@functools.lru_cache(maxsize=128)
+def _render_sections_html(canonical_analysis: bytes) -> str:
+    return str(render_analysis_sections(msgspec.json.decode(canonical_analysis)))
+
+
+def build_model_radio_buttons(selected_model: str, oob: bool = False) -> List[Any]:
+     """Builds one radio button Div per model; with oob=True they carry hx-swap-oob for response fragments."""
+     oob_attrs = {"hx_swap_oob": "true"} if oob else {}
+     return [
+         Div(
+             Label(
+                 Input(type="radio", name="model", value=value, checked=(selected_model == value), cls="mr-2"),
+                 Span(label, cls="text-gray-700")
+             ),
+             id=f"model-radio-{value}", # Ids must match between the dashboard and the OOB swaps
+             cls="mb-2",
+             **oob_attrs
+         )
+         for value, label in MODEL_OPTIONS
+     ]
+
+# Only three possible variants, so build and serialize each once at import; responses embed the frozen HTML
+_MODEL_SELECTION_CACHE: Dict[str, Group] = {
+    value: Group(*(NotStr(to_xml(button)) for button in build_model_radio_buttons(value, oob=True))) for value, _ in MODEL_OPTIONS
+}
 
 # Type hint: This helper returns a FastHTML Group component
 def render_model_selection_oob(selected_model: str) -> Group:
      """Helper function to render model selection radio buttons with OOB swap attributes."""
-     models = [("ollama", "Ollama (Local)"), ("lmstudio", "LMStudio (Local)"), ("gemini", "Gemini (Cloud)")]
-     buttons: List[Any] = [] # List to hold Div components
-     for value, label in models:
-         is_checked = (selected_model == value)
-         buttons.append(
-             Div(
-                 Label(
-                     Input(type="radio", name="model", value=value, checked=is_checked, cls="mr-2"),
-                     Span(label, cls="text-gray-700")
-                 ),
-                 id=f"model-radio-{value}",
-                 hx_swap_oob="true",
-                 cls="mb-2"
-             )
-         )
-     # Use tuple unpacking for Group arguments
-     return Group(*buttons)
\ No newline at end of file
+     # Unknown models (nothing checked) are rare enough to build on demand
+     cached = _MODEL_SELECTION_CACHE.get(selected_model)
+     return cached if cached is not None else Group(*build_model_radio_buttons(selected_model, oob=True))
@@ -1,11 +1,12 @@
 import os
 import asyncio
 import httpx
+import msgspec
 from dotenv import load_dotenv
 
 load_dotenv()
 
-async def list_models():
+async def list_models(client: httpx.AsyncClient):
     """List available Gemini models."""
     api_key = os.getenv("GEMINI_API_KEY", "")
     
@@ -21,22 +22,21 @@ async def list_models():
     }
     
     try:
-        async with httpx.AsyncClient() as client:
-            print("Listing available models...")
-            response = await client.get(url, headers=headers, timeout=30.0)
-            print(f"Response status: {response.status_code}")
-            
-            if response.status_code == 200:
-                result = response.json()
-                print("Available models:")
-                for model in result.get("models", []):
-                    print(f"- {model.get('name')}: {model.get('displayName')}")
-            else:
-                print(f"Error response: {response.text}")
+        print("Listing available models...")
+        response = await client.get(url, headers=headers, timeout=30.0)
+        print(f"Response status: {response.status_code}")
+        
+        if response.status_code == 200:
+            result = msgspec.json.decode(response.content)
+            print("Available models:")
+            for model in result.get("models", []):
+                print(f"- {model.get('name')}: {model.get('displayName')}")
+        else:
+            print(f"Error response: {response.text}")
     except Exception as e:
         print(f"Exception: {str(e)}")
 
-async def test_gemini_api():
+async def probe_generate(client: httpx.AsyncClient):
     """Test the Gemini API directly."""
     api_key = os.getenv("GEMINI_API_KEY", "")
     
@@ -67,35 +67,47 @@ async def test_gemini_api():
         }
     }
     
-    # Try each URL
-    for url in urls:
+    async def try_endpoint(url: str) -> bool:
+        """Posts to one endpoint; returns True if it produced a text response."""
         try:
-            async with httpx.AsyncClient() as client:
-                print(f"\nTrying endpoint: {url}")
-                response = await client.post(url, headers=headers, json=data, timeout=30.0)
-                print(f"Response status: {response.status_code}")
+            response = await client.post(url, headers=headers, json=data, timeout=30.0)
+            print(f"\n{url}\nResponse status: {response.status_code}")
+            
+            if response.status_code == 200:
+                result = msgspec.json.decode(response.content)
+                print("Response JSON keys:", result.keys())
                 
-                if response.status_code == 200:
-                    result = response.json()
-                    print("Response JSON keys:", result.keys())
-                    
-                    if "candidates" in result and result["candidates"]:
-                        text = result["candidates"][0]["content"]["parts"][0]["text"]
-                        print(f"Response text: {text}")
-                        return  # Success, no need to try other URLs
-                    else:
-                        print("No candidates in response:", result)
+                if "candidates" in result and result["candidates"]:
+                    text = result["candidates"][0]["content"]["parts"][0]["text"]
+                    print(f"Response text: {text}")
+                    return True
                 else:
-                    print(f"Error response: {response.text}")
+                    print("No candidates in response:", result)
+            else:
+                print(f"Error response: {response.text}")
         except Exception as e:
             print(f"Exception with {url}: {str(e)}")
+        return False
+
+    # Probe all endpoints at once (worst case one timeout instead of one per URL); first success wins
+    print(f"Trying {len(urls)} endpoints concurrently...")
+    tasks = [asyncio.create_task(try_endpoint(url)) for url in urls]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            if await next_done:
+                return  # Success, no need to wait for the other URLs
+    finally:
+        for task in tasks:
+            task.cancel()
 
 async def main():
-    # First list available models
-    await list_models()
-    print("\n" + "-"*50 + "\n")
-    # Then try to generate content
-    await test_gemini_api()
+    # One client for every request, so they all reuse the same connection to the API
+    async with httpx.AsyncClient() as client:
+        # First list available models
+        await list_models(client)
+        print("\n" + "-"*50 + "\n")
+        # Then try to generate content
+        await probe_generate(client)
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -7,15 +7,29 @@ import logging
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)s] %(message)s')
 logger = logging.getLogger(__name__)
 
+async def post_chat(session: aiohttp.ClientSession, label: str, url: str, data: dict) -> None:
+    """Sends one chat request and logs the outcome."""
+    try:
+        logger.info(f"{label}: Sending request to {url}")
+        timeout = aiohttp.ClientTimeout(total=30)
+        async with session.post(url, json=data, timeout=timeout) as response:
+            logger.info(f"{label}: Response status: {response.status}")
+            
+            if response.status == 200:
+                result = await response.json(content_type=None)
+                logger.info(f"{label}: Success! Response: {json.dumps(result, indent=2)[:200]}...")
+            else:
+                error_text = await response.text()
+                logger.error(f"{label}: API Error: {response.status} - {error_text[:500]}")
+    except Exception as e:
+        logger.exception(f"{label}: Error during API call: {e}")
+
 async def test_ollama_api():
     """Test the Ollama API directly using the same code as in llm_client.py"""
     provider = "Ollama"
     ollama_url = "http://127.0.0.1:11434"  # Using the exact URL from .env
     model = "phi4"
     
-    # Test 1: Direct curl-like request
-    logger.info(f"Test 1: Direct API call to {ollama_url}/api/chat")
-    url = f"{ollama_url}/api/chat"
     messages = [
         {"role": "system", "content": "You are a helpful assistant."},
         {"role": "user", "content": "Hello, how are you?"}
@@ -27,41 +41,14 @@ async def test_ollama_api():
         "options": {"temperature": 0.4}
     }
     
-    try:
-        async with aiohttp.ClientSession() as session:
-            logger.info(f"Sending request to {url}")
-            timeout = aiohttp.ClientTimeout(total=30)
-            async with session.post(url, json=data, timeout=timeout) as response:
-                logger.info(f"Response status: {response.status}")
-                
-                if response.status == 200:
-                    result = await response.json(content_type=None)
-                    logger.info(f"Success! Response: {json.dumps(result, indent=2)[:200]}...")
-                else:
-                    error_text = await response.text()
-                    logger.error(f"API Error: {response.status} - {error_text[:500]}")
-    except Exception as e:
-        logger.exception(f"Error during API call: {e}")
-    
-    # Test 2: Try with different URL structure
-    logger.info(f"\nTest 2: Alternative URL structure {ollama_url}/v1/chat/completions")
-    url2 = f"{ollama_url}/v1/chat/completions"
-    
-    try:
-        async with aiohttp.ClientSession() as session:
-            logger.info(f"Sending request to {url2}")
-            timeout = aiohttp.ClientTimeout(total=30)
-            async with session.post(url2, json=data, timeout=timeout) as response:
-                logger.info(f"Response status: {response.status}")
-                
-                if response.status == 200:
-                    result = await response.json(content_type=None)
-                    logger.info(f"Success! Response: {json.dumps(result, indent=2)[:200]}...")
-                else:
-                    error_text = await response.text()
-                    logger.error(f"API Error: {response.status} - {error_text[:500]}")
-    except Exception as e:
-        logger.exception(f"Error during API call: {e}")
+    # Test 1: Direct curl-like request to the native chat endpoint
+    # Test 2: Alternative URL structure (OpenAI-compatible endpoint)
+    # The two are independent, so run them concurrently over one shared session
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(
+            post_chat(session, "Test 1", f"{ollama_url}/api/chat", data),
+            post_chat(session, "Test 2", f"{ollama_url}/v1/chat/completions", data),
+        )
 
 if __name__ == "__main__":
     asyncio.run(test_ollama_api())
\ No newline at end of file
@@ -1,10 +1,14 @@
 from fasthtml.common import *
 from fastapi.security import OAuth2PasswordBearer # Keep for potential future use? Currently unused.
 import httpx
-import json
+import asyncio
+import functools
+import importlib.util
+import msgspec
 import os # Keep os for potential other uses, but not getenv here
 import logging
-from typing import Any
+from typing import Any, Optional, Tuple
+from urllib.parse import urlencode
 from starlette.requests import Request
 from starlette.responses import RedirectResponse, PlainTextResponse
 # Import the global settings instance
@@ -22,6 +26,72 @@ if not settings.google_client_id or not settings.google_client_secret:
 # Ensure it matches EXACTLY what's configured in Google Cloud Console
 REDIRECT_URI = f"{str(settings.app_base_url).rstrip('/')}/auth/callback"
 
+# --- OAuth endpoints ---
+# The endpoint URLs are fixed for the life of the process, so the HttpUrl -> str conversions are
+# done once here instead of on every login/callback. The credentials are read from settings per
+# request, so configuring them after import (tests, a settings reload) still takes effect.
+_AUTH_URL = str(settings.google_auth_uri)
+_TOKEN_URL = str(settings.google_token_uri)
+_USERINFO_URL = str(settings.google_userinfo_uri)
+
+def _oauth_configured() -> bool:
+    return bool(settings.google_client_id and settings.google_client_secret)
+
+@functools.lru_cache(maxsize=1)
+def _login_page(client_id: str) -> Tuple[str, NotStr]:
+    """Returns (Google login URL, rendered login page body). Nothing in them varies per request,
+    so they are built once per client ID."""
+    # URL encode parameters properly (FastHTML's A() doesn't do this automatically)
+    login_url = f"{_AUTH_URL}?" + urlencode({
+        'client_id': client_id,
+        'redirect_uri': REDIRECT_URI,
+        'response_type': 'code',
+        'scope': 'openid email profile' # Standard scopes
+    })
+    # Basic login page
+    body = NotStr(to_xml(Main(
+        H1("AI PM Assistant Login"),
+        P("Please log in using your Google account."),
+        A("Login with Google", href=login_url, cls="btn", style="display: inline-block; margin-top: 1rem;"),
+        cls="container text-center p-8" # Added some basic styling
+    )))
+    return login_url, body
+
+# --- Shared HTTP client ---
+# Reused across logins so the token/userinfo calls to Google ride keep-alive connections
+# instead of a fresh TCP+TLS handshake per callback. Its pool is bound to the event loop it
+# was created on, so a new loop gets a new client.
+_oauth_client: Optional[httpx.AsyncClient] = None
+_oauth_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def get_oauth_client() -> httpx.AsyncClient:
+    """Returns the shared client for Google OAuth calls, creating it on first use (or after it was closed)."""
+    global _oauth_client, _oauth_client_loop
+    loop = asyncio.get_running_loop()
+    if _oauth_client is None or _oauth_client.is_closed or _oauth_client_loop is not loop:
+        _oauth_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_keepalive_connections=10, max_connections=20, keepalive_expiry=60.0),
+            timeout=httpx.Timeout(10.0),
+            http2=importlib.util.find_spec("h2") is not None,  # Needs `httpx[http2]`
+        )
+        _oauth_client_loop = loop
+    return _oauth_client
+
+async def _warm_connection(client: httpx.AsyncClient, url: str) -> None:
+    """Opens (and pools) a connection to url's host; the response itself is irrelevant."""
+    try:
+        await client.head(url)
+    except Exception as e:  # Best effort: a failed warm-up must never surface from the task
+        logger.debug("Connection warm-up to %s failed: %s", url, e)
+
+async def close_oauth_client() -> None:
+    """Closes the shared OAuth client (called on app shutdown)."""
+    global _oauth_client, _oauth_client_loop
+    if _oauth_client is not None and not _oauth_client.is_closed and _oauth_client_loop is asyncio.get_running_loop():
+        await _oauth_client.aclose()
+    _oauth_client = None
+    _oauth_client_loop = None
+
 # Not using FastAPI's OAuth2PasswordBearer flow directly here, but define for clarity
 # oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token") # Example if needed later
 
@@ -33,31 +103,13 @@ def add_auth_routes(rt):
             return RedirectResponse(url='/')
 
         # Ensure OAuth is configured before attempting login
-        if not settings.google_client_id or not settings.google_client_secret:
+        if not _oauth_configured():
              return PlainTextResponse("OAuth is not configured correctly on the server.", status_code=500)
 
-        # Construct Google OAuth URL using settings
-        auth_endpoint = str(settings.google_auth_uri)
-        client_id = settings.google_client_id
-
-        # URL encode parameters properly (FastHTML's A() doesn't do this automatically)
-        from urllib.parse import urlencode
-        params = urlencode({
-            'client_id': client_id,
-            'redirect_uri': REDIRECT_URI,
-            'response_type': 'code',
-            'scope': 'openid email profile' # Standard scopes
-        })
-        login_url = f"{auth_endpoint}?{params}"
-        logger.info(f"Redirecting user to Google login: {login_url}")
-
-        # Basic login page
-        return Title("Login"), Main(
-            H1("AI PM Assistant Login"),
-            P("Please log in using your Google account."),
-            A("Login with Google", href=login_url, cls="btn", style="display: inline-block; margin-top: 1rem;"),
-            cls="container text-center p-8" # Added some basic styling
-        )
+        login_url, login_body = _login_page(settings.google_client_id)
+        logger.info("Serving login page (Google login URL: %s)", login_url)
+        # Page wrapper (head, scripts) is still added by FastHTML; only the static body is pre-rendered
+        return Title("Login"), login_body
 
     @rt('/auth/callback')
     async def cb(r: Request, code: str | None = None, error: str | None = None) -> Any:
@@ -71,55 +123,62 @@ def add_auth_routes(rt):
              return RedirectResponse(url='/login?error=missing_code')
 
         # Ensure OAuth is configured before proceeding
-        if not settings.google_client_id or not settings.google_client_secret:
+        secret = settings.google_client_secret
+        if not settings.google_client_id or secret is None:
              logger.error("OAuth callback received but server OAuth is not configured.")
              return PlainTextResponse("OAuth is not configured correctly on the server.", status_code=500)
 
         # Exchange code for token
-        token_endpoint = str(settings.google_token_uri)
-        client_id = settings.google_client_id
-        client_secret = settings.google_client_secret.get_secret_value() # Use secret value
-
+        token_endpoint = _TOKEN_URL
         token_data = {
             'code': code,
-            'client_id': client_id,
-            'client_secret': client_secret,
+            'client_id': settings.google_client_id,
+            'client_secret': secret.get_secret_value(),
             'redirect_uri': REDIRECT_URI,
             'grant_type': 'authorization_code'
         }
 
-        async with httpx.AsyncClient() as c:
-            try:
-                logger.info(f"Exchanging code for token at: {token_endpoint}")
-                token_response = await c.post(token_endpoint, data=token_data)
-                token_response.raise_for_status() # Raise exception for 4xx/5xx errors
-                token_json = token_response.json()
-                access_token = token_json.get('access_token')
-
-                if not access_token:
-                    logger.error(f"Access token not found in Google's response: {token_json}")
-                    return RedirectResponse(url='/login?error=token_exchange_failed')
-
-                # Get user info
-                userinfo_endpoint = str(settings.google_userinfo_uri)
-                logger.info(f"Fetching user info from: {userinfo_endpoint}")
-                userinfo_response = await c.get(userinfo_endpoint, headers={'Authorization': f'Bearer {access_token}'})
-                userinfo_response.raise_for_status()
-                userinfo_json = userinfo_response.json()
-                user_email = userinfo_json.get('email')
-
-                if not user_email:
-                    logger.error(f"Email not found in userinfo response: {userinfo_json}")
-                    return RedirectResponse(url='/login?error=userinfo_failed')
-
-                # Store email in session and redirect to dashboard
-                r.session['user_email'] = user_email
-                logger.info(f"User logged in successfully: {user_email}")
-                return RedirectResponse(url='/', status_code=303) # Use 303 See Other after POST-like action
-
-            except httpx.HTTPStatusError as e:
-                logger.error(f"HTTP error during OAuth flow: {e.response.status_code} - {e.response.text}")
-                return RedirectResponse(url='/login?error=oauth_http_error')
-            except Exception as e:
-                logger.exception(f"Unexpected error during OAuth callback: {e}")
-                return RedirectResponse(url='/login?error=internal_error')
\ No newline at end of file
+        c = get_oauth_client()
+        userinfo_endpoint = _USERINFO_URL
+        # The userinfo host differs from the token host, so its TCP+TLS setup can't share the token
+        # connection; warm it up while the token exchange is in flight to save that handshake
+        warmup = asyncio.create_task(_warm_connection(c, userinfo_endpoint))
+        try:
+            logger.info(f"Exchanging code for token at: {token_endpoint}")
+            token_response = await c.post(token_endpoint, data=token_data)
+            token_response.raise_for_status() # Raise exception for 4xx/5xx errors
+            token_json = msgspec.json.decode(token_response.content) # Straight from the raw bytes
+            access_token = token_json.get('access_token')
+
+            if not access_token:
+                logger.error(f"Access token not found in Google's response: {token_json}")
+                return RedirectResponse(url='/login?error=token_exchange_failed')
+
+            # Get user info (reuses the warmed connection once the HEAD has completed)
+            await warmup
+            logger.info(f"Fetching user info from: {userinfo_endpoint}")
+            userinfo_response = await c.get(userinfo_endpoint, headers={'Authorization': f'Bearer {access_token}'})
+            userinfo_response.raise_for_status()
+            userinfo_json = msgspec.json.decode(userinfo_response.content)
+            user_email = userinfo_json.get('email')
+
+            if not user_email:
+                logger.error(f"Email not found in userinfo response: {userinfo_json}")
+                return RedirectResponse(url='/login?error=userinfo_failed')
+
+            # Store email in session and redirect to dashboard
+            r.session['user_email'] = user_email
+            logger.info(f"User logged in successfully: {user_email}")
+            return RedirectResponse(url='/', status_code=303) # Use 303 See Other after POST-like action
+
+        except httpx.HTTPStatusError as e:
+            logger.error(f"HTTP error during OAuth flow: {e.response.status_code} - {e.response.text}")
+            return RedirectResponse(url='/login?error=oauth_http_error')
+        except Exception as e:
+            logger.exception(f"Unexpected error during OAuth callback: {e}")
+            return RedirectResponse(url='/login?error=internal_error')
+        finally:
+            # No-op once awaited; otherwise stops the warm-up on the early-return and error paths
+            # and waits for it to unwind (gather keeps a cancellation of cb itself propagating)
+            warmup.cancel()
+            await asyncio.gather(warmup, return_exceptions=True)
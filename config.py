@@ -1,12 +1,10 @@
 import os
 from pydantic_settings import BaseSettings
 from pydantic import Field, HttpUrl, SecretStr, PositiveInt
-from dotenv import load_dotenv
 from typing import Optional
 
-# Load .env file explicitly before BaseSettings reads it
-# This ensures variables are available if BaseSettings is imported early
-load_dotenv()
+# .env is read by BaseSettings itself (model_config["env_file"]); nothing else reads os.environ,
+# so it is not also loaded into the process environment
 
 class Settings(BaseSettings):
     """Application Configuration"""
@@ -22,12 +20,31 @@ class Settings(BaseSettings):
     lmstudio_model: Optional[str] = Field("gemma-3-1b-it-GGUF/gemma-3-1b-it-Q4_K_M.gguf", description="Model identifier for LMStudio")
     gemini_model: str = Field("models/gemini-1.5-flash-latest", description="Model identifier for Gemini")
 
+    # Maximum concurrent in-flight requests per LLM provider (protects against rate limiting)
+    provider_max_concurrency: PositiveInt = Field(8, description="Max concurrent requests per LLM provider")
+    # Ollama queues requests per model server-side (OLLAMA_NUM_PARALLEL), so extra in-flight calls only wait there
+    ollama_max_concurrency: PositiveInt = Field(1, description="Max concurrent requests to Ollama")
+
+    # Number of successful analyses kept in the in-process LRU cache (0 disables caching)
+    response_cache_size: int = Field(256, ge=0, description="Max entries in the in-process analysis response cache")
+    response_cache_ttl_seconds: PositiveInt = Field(3600, description="Lifetime of entries in the in-process analysis response cache")
+    # Failed analyses are kept only briefly: enough to absorb repeated submits against a down provider
+    error_cache_ttl_seconds: int = Field(3, ge=0, description="Lifetime of cached error results (0 disables)")
+
     # --- Redis ---
-    # Note: Redis is currently unused in main.py, but keeping config here
+    # Used by the optional semantic cache (semantic_cache.py)
     redis_host: str = Field("localhost", description="Hostname for Redis server")
     redis_port: PositiveInt = Field(6379, description="Port for Redis server")
     redis_db: int = Field(0, description="Redis database number")
 
+    # --- Semantic Cache (RedisVL, optional) ---
+    semantic_cache_enabled: bool = Field(False, description="Serve semantically similar queries from the Redis semantic cache")
+    # Cosine distance (1 - similarity): 0.08 only accepts paraphrases with similarity >= 0.92
+    semantic_cache_distance_threshold: float = Field(0.08, gt=0, description="Max cosine distance for a semantic cache hit")
+    semantic_cache_ttl_seconds: PositiveInt = Field(86400, description="Lifetime of semantic cache entries")
+    semantic_cache_embedding_model: str = Field("redis/langcache-embed-v1", description="HuggingFace model used to embed queries")
+    semantic_cache_embedding_ttl_seconds: PositiveInt = Field(7 * 86400, description="Lifetime of cached query embeddings")
+
     # --- Web App ---
     app_host: str = Field("localhost", description="Host for the FastAPI application")
     app_port: PositiveInt = Field(5001, description="Port for the FastAPI application")
@@ -35,6 +52,10 @@ class Settings(BaseSettings):
     # Secret key for session middleware - MUST be set in production
     session_secret_key: SecretStr = Field(SecretStr("default-insecure-secret-key-replace-me"), description="Secret key for session management")
 
+    # --- Logging ---
+    log_level: str = Field("INFO", description="Console log level (set WARNING in production to silence per-request diagnostics)")
+    log_ring_buffer_size: PositiveInt = Field(500, description="Number of recent INFO+ log records kept in memory for post-mortem inspection")
+
     # --- Google OAuth ---
     google_client_id: Optional[str] = Field(None, description="Google OAuth Client ID")
     google_client_secret: Optional[SecretStr] = Field(None, description="Google OAuth Client Secret")
@@ -45,8 +66,8 @@ class Settings(BaseSettings):
 
     # --- Pydantic Settings Configuration ---
     model_config = {
-        # Load from .env file if it exists
-        "env_file": '.env',
+        # Load from the .env file next to this module if it exists (independent of the working directory)
+        "env_file": os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env'),
         "env_file_encoding": 'utf-8',
         # Allow extra fields (though we aim to define all)
         "extra": 'ignore',
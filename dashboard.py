@@ -1,89 +1,130 @@
 from fasthtml.common import *
-from fastapi import Depends
+import fasthtml
+import hashlib
 from starlette.requests import Request
-from typing import Any
+from starlette.responses import RedirectResponse, Response
+from typing import Any, Dict, Sequence
+
+from analysis import MODEL_OPTIONS, build_model_radio_buttons
+from utils import session_user, static_url
 
 # Removed Tailwind CSS CDN link
 
 # Define the path to the local CSS file
-local_css = Link(rel="stylesheet", href="/static/styles.css")
+local_css = Link(rel="stylesheet", href=static_url("styles.css"))
+# Head elements, built once. They stay components (not a pre-rendered NotStr) because FastHTML
+# moves title/link tags into <head> by tag name; raw HTML would land in <body>.
+DASHBOARD_HEAD = (Title("AI-PM Dashboard"), local_css)
 
-def add_dashboard_routes(rt, get_user):
-    @rt('/')
-    async def dash(r: Request, email: str = Depends(get_user)) -> Any:
-        selected_model = r.session.get('selected_llm', 'ollama')
-        # Basic structure using FastHTML components and Tailwind classes
-        # Assumes styles.css contains necessary Tailwind classes or custom styles
-        return (
-            Title("AI-PM Dashboard"),
-            local_css,  # Include local CSS file link in the head
-            # Optional: Add JS if needed later
-            # Script(src="/static/app.js"),
-            Main(
-                Div( # Outer container for centering and padding
-                    H3("🔍 Competitive Analysis Agent", cls="text-2xl font-bold mb-4 text-gray-800"),
-                    P("Enter a query to analyze competitors and market trends.", cls="text-sm text-gray-600 mb-4"),
-                    Form(
-                        # Model selection
-                        Div(
-                            H4("Select Model", cls="text-lg font-semibold text-gray-700 mb-2"),
-                            Div(
-                                Div(
-                                    Label(Input(type="radio", name="model", value="ollama", checked=selected_model == "ollama", cls="mr-2"), Span("Ollama (Local)", cls="text-gray-700")),
-                                    id="model-radio-ollama", # Ensure IDs match for OOB swap
-                                    cls="mb-2"
-                                ),
-                                Div(
-                                    Label(Input(type="radio", name="model", value="lmstudio", checked=selected_model == "lmstudio", cls="mr-2"), Span("LMStudio (Local)", cls="text-gray-700")),
-                                    id="model-radio-lmstudio",
-                                    cls="mb-2"
-                                ),
-                                Div(
-                                    Label(Input(type="radio", name="model", value="gemini", checked=selected_model == "gemini", cls="mr-2"), Span("Gemini (Cloud)", cls="text-gray-700")),
-                                    id="model-radio-gemini",
-                                    cls="mb-2"
-                                ),
-                                cls="space-y-2 bg-gray-50 p-4 rounded-lg shadow-sm border border-gray-200" # Added border
-                            ),
-                            cls="mb-6"
-                        ),
-                        # Query input
-                        Div(
-                            Div(
-                                Label("Enter your query:", for_="q", cls="block text-sm font-medium text-gray-700 mb-1"),
-                                Span(
-                                    "Use sample",
-                                    cls="ml-1 text-[8px] bg-gray-100 text-gray-500 py-0 px-0.5 rounded-sm border border-gray-200 hover:bg-gray-200 transition duration-200 leading-tight cursor-pointer",
-                                    onclick="document.getElementById('q').value='Analyse crm market competitors'; return false;"
-                                ),
-                                cls="flex items-center"
-                            ),
-                            Textarea( # Changed to Textarea for potentially longer queries
-                                id="q", name="q", placeholder="e.g., Analyze CRM market competitors focusing on AI features and pricing models...",
-                                cls="w-full p-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500 mb-2", # Added mb-2
-                                rows="3" # Set initial rows for textarea
-                            ),
-                            cls="mb-4"
-                        ),
-                        # Submit button
-                        Button(
-                            "Analyze", type="submit",
-                            cls="w-full bg-blue-600 text-white py-2 px-4 rounded-md hover:bg-blue-700 transition duration-200",
-                            # Use standard htmx indicator approach if preferred over button text change
-                            # hx_indicator="#analyze-indicator"
-                             _="on click set my innerHTML to 'Analyzing...' then add @disabled until htmx:afterRequest" # Keep simple button state change
+def build_dashboard_main(selected_model: str) -> FT:
+    """Builds the dashboard body; the only per-request input is which model radio is checked."""
+    # Basic structure using FastHTML components and Tailwind classes
+    # Assumes styles.css contains necessary Tailwind classes or custom styles
+    return Main(
+        Div( # Outer container for centering and padding
+            H3("🔍 Competitive Analysis Agent", cls="text-2xl font-bold mb-4 text-gray-800"),
+            P("Enter a query to analyze competitors and market trends.", cls="text-sm text-gray-600 mb-4"),
+            Form(
+                # Model selection
+                Div(
+                    H4("Select Model", cls="text-lg font-semibold text-gray-700 mb-2"),
+                    Div(
+                        *build_model_radio_buttons(selected_model),
+                        cls="space-y-2 bg-gray-50 p-4 rounded-lg shadow-sm border border-gray-200" # Added border
+                    ),
+                    cls="mb-6"
+                ),
+                # Query input
+                Div(
+                    Div(
+                        Label("Enter your query:", for_="q", cls="block text-sm font-medium text-gray-700 mb-1"),
+                        Span(
+                            "Use sample",
+                            cls="ml-1 text-[8px] bg-gray-100 text-gray-500 py-0 px-0.5 rounded-sm border border-gray-200 hover:bg-gray-200 transition duration-200 leading-tight cursor-pointer",
+                            onclick="document.getElementById('q').value='Analyse crm market competitors'; return false;"
                         ),
-                        # Span(id="analyze-indicator", cls="htmx-indicator ml-2", content="⏳"), # Standard indicator
-                        # --- HTMX Attributes ---
-                        hx_post="/analyze",      # Endpoint to submit the form
-                        hx_target="#resp",       # Target div to update with loading state/results
-                        hx_swap="innerHTML",     # Replace content of the target
-                        hx_include="[name='model'], [name='q']" # Include model and query
+                        cls="flex items-center"
                     ),
-                    # Response area
-                    Div(id="resp", cls="mt-6"), # Area where loading state and results appear
-                    cls="max-w-lg mx-auto p-6 bg-white rounded-xl shadow-lg border border-gray-200" # Use bg-white for card
+                    Textarea( # Changed to Textarea for potentially longer queries
+                        id="q", name="q", placeholder="e.g., Analyze CRM market competitors focusing on AI features and pricing models...",
+                        cls="w-full p-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500 mb-2", # Added mb-2
+                        rows="3" # Set initial rows for textarea
+                    ),
+                    cls="mb-4"
+                ),
+                # Submit button
+                Button(
+                    "Analyze", type="submit",
+                    cls="w-full bg-blue-600 text-white py-2 px-4 rounded-md hover:bg-blue-700 transition duration-200",
+                    # Use standard htmx indicator approach if preferred over button text change
+                    # hx_indicator="#analyze-indicator"
+                     _="on click set my innerHTML to 'Analyzing...' then add @disabled until htmx:afterRequest" # Keep simple button state change
                 ),
-                cls="container mx-auto mt-8" # Apply container class to Main or a wrapper Div
-            )
-        )
\ No newline at end of file
+                # Runs the query on every model at once and shows the results side by side
+                Button(
+                    "Compare all models", type="button",
+                    cls="w-full mt-2 bg-white text-blue-600 py-2 px-4 rounded-md border border-blue-600 hover:bg-blue-50 transition duration-200",
+                    hx_post="/analyze-all",
+                    hx_target="#resp",
+                    hx_swap="outerHTML",
+                    hx_include="[name='q']"
+                ),
+                # Span(id="analyze-indicator", cls="htmx-indicator ml-2", content="⏳"), # Standard indicator
+                # --- HTMX Attributes ---
+                hx_post="/analyze",      # Endpoint to submit the form
+                hx_target="#resp",       # Target div to update with loading state/results
+                hx_swap="innerHTML",     # Replace content of the target
+                hx_include="[name='model'], [name='q']" # Include model and query
+            ),
+            # Response area
+            Div(id="resp", cls="mt-6"), # Area where loading state and results appear
+            cls="max-w-lg mx-auto p-6 bg-white rounded-xl shadow-lg border border-gray-200" # Use bg-white for card
+        ),
+        cls="container mx-auto mt-8" # Apply container class to Main or a wrapper Div
+    )
+
+# Dashboard body rendered to HTML once per model option at import, so no request builds the tree
+_DASHBOARD_MAIN: Dict[str, NotStr] = {
+    value: NotStr(to_xml(build_dashboard_main(value))) for value, _ in MODEL_OPTIONS
+}
+
+def render_dashboard_main(selected_model: str) -> NotStr:
+    """Returns the pre-rendered dashboard body. An unknown model (the session stores whatever the
+    form sent) gets the default variant instead of a new render, so the set of bodies stays fixed."""
+    return _DASHBOARD_MAIN.get(selected_model) or _DASHBOARD_MAIN["ollama"]
+
+# --- Conditional GETs ---
+# The page is fully determined by the body variant, the head, the app-wide hdrs (htmx and its SSE
+# extension) and the FastHTML page shell, so each variant gets a fixed ETag. Repeat loads that send
+# it back in If-None-Match get an empty 304.
+def build_dashboard_etags(app_hdrs: Sequence[Any]) -> Dict[str, str]:
+    """Returns the ETag digest of each pre-rendered body variant, given the app's hdrs."""
+    shell = f"{to_xml(DASHBOARD_HEAD)}{''.join(to_xml(h) for h in app_hdrs)}{fasthtml.__version__}"
+    return {
+        value: hashlib.blake2b(f"{body}{shell}".encode(), digest_size=8).hexdigest()
+        for value, body in _DASHBOARD_MAIN.items()
+    }
+
+def dashboard_etag(digests: Dict[str, str], selected_model: str, partial: bool) -> str:
+    """Weak ETag for the dashboard; HTMX requests get the page without the shell, so a distinct tag."""
+    digest = digests.get(selected_model) or digests["ollama"]
+    return f'W/"{digest}-htmx"' if partial else f'W/"{digest}"'
+
+def add_dashboard_routes(rt, app_hdrs: Sequence[Any] = ()):
+    etags = build_dashboard_etags(app_hdrs)
+
+    @rt('/')
+    async def dash(r: Request) -> Any:
+        if session_user(r) is None:
+            return RedirectResponse('/login', status_code=303)
+        selected_model = r.session.get('selected_llm', 'ollama')
+        # Same rule FastHTML uses to decide whether to wrap the response in the full page
+        partial = 'hx-request' in r.headers and 'hx-history-restore-request' not in r.headers
+        etag = dashboard_etag(etags, selected_model, partial)
+        # no-cache: browsers may keep the page but must revalidate it (cheap, thanks to the ETag)
+        cache_headers = {"ETag": etag, "Vary": "HX-Request", "Cache-Control": "no-cache"}
+        if etag in r.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=cache_headers)
+        # Optional: Add JS if needed later (Script(src="/static/app.js") in DASHBOARD_HEAD)
+        return (*DASHBOARD_HEAD, render_dashboard_main(selected_model),
+                *(HttpHeader(k, v) for k, v in cache_headers.items()))
@@ -1,8 +1,12 @@
 """Type stubs for fastapi.templating module."""
 from typing import Any, Dict, Optional
 
+from jinja2 import Environment
+
 class Jinja2Templates:
     """Jinja2 templates class."""
+    env: Environment
+
     def __init__(
         self,
         directory: str,
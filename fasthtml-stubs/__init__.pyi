@@ -1 +1,2 @@
-"""Type stubs for fasthtml package."""
\ No newline at end of file
+"""Type stubs for fasthtml package."""
+__version__: str
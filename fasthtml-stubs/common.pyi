@@ -1,49 +1,72 @@
 """Type stubs for fasthtml.common module."""
 from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from fasthtml.components import FT as FT, Script as Script
 
-def fast_app(with_session: bool = False, secret_key: str = "") -> Tuple[Any, Any]: ...
+def fast_app(
+    with_session: bool = False,
+    secret_key: str = "",
+    session_cookie: str = "session_",
+    max_age: int = 31536000,
+    same_site: str = "lax",
+    sess_https_only: bool = False,
+    hdrs: Optional[Tuple[Any, ...]] = None,
+    **kwargs: Any,
+) -> Tuple[Any, Any]: ...
 
-class Link:
+class NotStr(str): ...
+
+def to_xml(elm: Any, lvl: int = 0, indent: bool = True, do_escape: bool = True) -> str: ...
+
+def sse_message(elm: Any, event: str = "message") -> str: ...
+
+def EventStream(s: Any) -> Any: ...
+
+class HttpHeader:
+    k: str
+    v: str
+    def __init__(self, k: str, v: str) -> None: ...
+
+class Link(FT):
     def __init__(self, rel: str = "", href: str = "", **kwargs: Any) -> None: ...
 
-class Title:
+class Title(FT):
     def __init__(self, content: Any = "", **kwargs: Any) -> None: ...
 
-class Main:
+class Main(FT):
     def __init__(self, *args: Any, **kwargs: Any) -> None: ...
 
-class Div:
+class Div(FT):
     def __init__(self, *args: Any, **kwargs: Any) -> None: ...
 
-class H1:
+class H1(FT):
     def __init__(self, content: Any = "", **kwargs: Any) -> None: ...
 
-class H3:
+class H3(FT):
     def __init__(self, content: Any = "", **kwargs: Any) -> None: ...
 
-class H4:
+class H4(FT):
     def __init__(self, content: Any = "", **kwargs: Any) -> None: ...
 
-class P:
+class P(FT):
     def __init__(self, content: Any = "", **kwargs: Any) -> None: ...
 
-class Form:
+class Form(FT):
     def __init__(self, *args: Any, **kwargs: Any) -> None: ...
 
-class Label:
+class Label(FT):
     def __init__(self, *args: Any, for_: str = "", **kwargs: Any) -> None: ...
 
-class Input:
+class Input(FT):
     def __init__(self, type: str = "", name: str = "", value: str = "", checked: bool = False, **kwargs: Any) -> None: ...
 
-class Span:
+class Span(FT):
     def __init__(self, content: Any = "", **kwargs: Any) -> None: ...
 
-class Textarea:
+class Textarea(FT):
     def __init__(self, id: str = "", name: str = "", placeholder: str = "", rows: str = "", **kwargs: Any) -> None: ...
 
-class Button:
+class Button(FT):
     def __init__(self, content: Any = "", type: str = "", **kwargs: Any) -> None: ...
 
-class A:
+class A(FT):
     def __init__(self, content: Any = "", href: str = "", **kwargs: Any) -> None: ...
\ No newline at end of file
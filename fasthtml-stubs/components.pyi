@@ -1,32 +1,35 @@
 """Type stubs for fasthtml.components module."""
-from typing import Any, List, Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
-class Group:
+class FT:
+    def __init__(self, tag: str, cs: Tuple[Any, ...], attrs: Optional[Dict[str, Any]] = None, **kwargs: Any) -> None: ...
+
+class Group(FT):
     def __init__(self, *args: Any, **kwargs: Any) -> None: ...
 
-class Div:
+class Div(FT):
     def __init__(self, *args: Any, **kwargs: Any) -> None: ...
 
-class H3:
+class H3(FT):
     def __init__(self, content: Any = "", **kwargs: Any) -> None: ...
 
-class P:
+class P(FT):
     def __init__(self, content: Any = "", **kwargs: Any) -> None: ...
 
-class Script:
+class Script(FT):
     def __init__(self, content: Any = "", src: str = "", **kwargs: Any) -> None: ...
 
-class Pre:
+class Pre(FT):
     def __init__(self, content: Any = "", **kwargs: Any) -> None: ...
 
-class Label:
+class Label(FT):
     def __init__(self, *args: Any, for_: str = "", **kwargs: Any) -> None: ...
 
-class Input:
+class Input(FT):
     def __init__(self, type: str = "", name: str = "", value: str = "", checked: bool = False, **kwargs: Any) -> None: ...
 
-class Span:
+class Span(FT):
     def __init__(self, content: Any = "", **kwargs: Any) -> None: ...
 
-class Textarea:
+class Textarea(FT):
     def __init__(self, id: str = "", name: str = "", placeholder: str = "", rows: str = "", **kwargs: Any) -> None: ...
\ No newline at end of file
@@ -2,29 +2,188 @@
 # ---- File: llm_client.py ----
 
 import httpx
-import json
+import asyncio
+import functools
 import re
 import logging
 import aiohttp
-from typing import Optional, Any, Dict, Union
+import msgspec
+from typing import Optional, Any, Dict, List, Tuple, Union, Callable, Awaitable, TypeVar, AsyncIterator
 from pydantic import SecretStr, BaseModel
 
 # Import the global settings instance
 from config import settings
+from logging_config import configure_logging
 
 # Setup logging
-logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)d] %(message)s')
+configure_logging()
 logger = logging.getLogger(__name__)
 
+# --- Static request payload parts (built once, shared across calls) ---
+_GEMINI_PAYLOAD_TEMPLATE: Dict[str, Any] = {
+    "generationConfig": {"temperature": 0.4, "topK": 40, "topP": 0.95, "maxOutputTokens": 3500, "response_mime_type": "application/json"}
+}
+_OLLAMA_PAYLOAD_TEMPLATE: Dict[str, Any] = {
+    "stream": False, "format": "json", "options": {"temperature": 0.4, "top_k": 40, "top_p": 0.95}
+}
+_LMSTUDIO_PAYLOAD_TEMPLATE: Dict[str, Any] = {"temperature": 0.4, "max_tokens": 3500, "stream": False}
+# Bodies are pre-encoded with msgspec, so the content type must be set explicitly
+_JSON_HEADERS: Dict[str, str] = {"Content-Type": "application/json"}
+
+# --- Success-path response shapes ---
+# Only the generated text is needed from a completion; decoding into these Structs lets msgspec skip
+# everything else (safety ratings, usage metadata, ...) instead of building the full dict tree.
+# A body that doesn't match falls back to a generic decode, which feeds the detailed error messages.
+class _GeminiPart(msgspec.Struct):
+    text: str
+
+class _GeminiContent(msgspec.Struct):
+    parts: List[_GeminiPart]
+
+class _GeminiCandidate(msgspec.Struct):
+    content: _GeminiContent
+
+class _GeminiResponse(msgspec.Struct):
+    candidates: List[_GeminiCandidate]
+
+class _ChatMessage(msgspec.Struct):
+    content: str
+
+class _ChatChoice(msgspec.Struct):
+    message: _ChatMessage
+
+class _ChatResponse(msgspec.Struct):
+    choices: List[_ChatChoice]
+
+_GEMINI_RESPONSE_DECODER = msgspec.json.Decoder(_GeminiResponse)
+_CHAT_RESPONSE_DECODER = msgspec.json.Decoder(_ChatResponse)
+
+# Prefix of event lines in the Gemini/LMStudio server-sent event streams
+_SSE_DATA_PREFIX = "data:"
+# Statuses meaning the server rejected streaming itself (not the request); a plain call may still work
+_STREAM_UNSUPPORTED_STATUSES = frozenset({400, 404, 405, 501})
+
+# --- Shared HTTP client ---
+# One pooled client per process so Gemini/LMStudio calls reuse keep-alive connections
+# instead of paying a TCP+TLS handshake per request. Pooled connections belong to the event loop
+# that opened them, so a new loop gets a new client.
+_http_client: Optional[httpx.AsyncClient] = None
+_http_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+# HTTP/2 lets concurrent Gemini requests multiplex over one TLS connection (needs `httpx[http2]`)
+try:
+    import h2  # noqa: F401
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+def get_http_client() -> httpx.AsyncClient:
+    """Returns the shared httpx client, creating it on first use (or after it was closed)."""
+    global _http_client, _http_client_loop
+    loop = asyncio.get_running_loop()
+    if _http_client is None or _http_client.is_closed or _http_client_loop is not loop:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64, keepalive_expiry=60),
+            timeout=httpx.Timeout(180.0, connect=10.0),
+            http2=_HTTP2_AVAILABLE,
+        )
+        _http_client_loop = loop
+    return _http_client
+
+# Ollama is called through aiohttp; its session (connector, resolver, cookie jar) is likewise shared.
+# A session is bound to the event loop it was created on, so a new loop gets a new session.
+_ollama_session: Optional[aiohttp.ClientSession] = None
+_ollama_session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def get_ollama_session() -> aiohttp.ClientSession:
+    """Returns the shared aiohttp session for Ollama, creating it on first use (or after it was closed)."""
+    global _ollama_session, _ollama_session_loop
+    loop = asyncio.get_running_loop()
+    if _ollama_session is None or _ollama_session.closed or _ollama_session_loop is not loop:
+        _ollama_session = aiohttp.ClientSession(
+            # Cache resolved hosts so a remote OLLAMA_URL isn't looked up again on every call
+            connector=aiohttp.TCPConnector(limit=64, keepalive_timeout=75, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=180),
+        )
+        _ollama_session_loop = loop
+    return _ollama_session
+
+async def close_http_client() -> None:
+    """Closes the shared httpx client and Ollama session. Called on application shutdown."""
+    global _http_client, _http_client_loop, _ollama_session, _ollama_session_loop
+    if _http_client is not None and not _http_client.is_closed and _http_client_loop is asyncio.get_running_loop():
+        await _http_client.aclose()
+    _http_client = None
+    _http_client_loop = None
+    if _ollama_session is not None and not _ollama_session.closed and _ollama_session_loop is asyncio.get_running_loop():
+        await _ollama_session.close()
+    _ollama_session = None
+    _ollama_session_loop = None
+
+
+# --- Per-provider concurrency limits ---
+# Shared across all AIClient instances so fan-out (e.g. comparing models) cannot flood one provider.
+# Ollama gets its own (default 1) cap: it queues parallel requests internally, so holding them here keeps
+# its slow calls from piling up while Gemini and LMStudio in a "compare all" fan-out run freely.
+_PROVIDER_LIMITS: Dict[str, int] = {
+    "gemini": settings.provider_max_concurrency,
+    "ollama": settings.ollama_max_concurrency,
+    "lmstudio": settings.provider_max_concurrency,
+}
+# A semaphore binds to the first event loop that contends it, so like the Ollama session,
+# each event loop gets its own set.
+_provider_semaphores: Dict[str, asyncio.Semaphore] = {}
+_provider_semaphores_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def get_provider_semaphore(provider: str) -> asyncio.Semaphore:
+    """Returns the running event loop's concurrency semaphore for `provider`."""
+    global _provider_semaphores, _provider_semaphores_loop
+    loop = asyncio.get_running_loop()
+    if _provider_semaphores_loop is not loop:
+        _provider_semaphores = {name: asyncio.Semaphore(limit) for name, limit in _PROVIDER_LIMITS.items()}
+        _provider_semaphores_loop = loop
+    return _provider_semaphores[provider]
+
+_T = TypeVar("_T")
+
+def _limit_concurrency(provider: str) -> Callable[[Callable[..., Awaitable[_T]]], Callable[..., Awaitable[_T]]]:
+    """Decorator bounding how many calls to a provider may be in flight at once."""
+    def decorator(func: Callable[..., Awaitable[_T]]) -> Callable[..., Awaitable[_T]]:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> _T:
+            async with get_provider_semaphore(provider):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Markdown fence patterns, compiled once (applied per line)
+_FENCE_OPEN_RE = re.compile(r'^\s*```(?:json)?\s*', re.IGNORECASE | re.MULTILINE)
+_FENCE_CLOSE_RE = re.compile(r'\s*```\s*$', re.MULTILINE)
 
 def clean_json_response(text: str) -> str:
     """Removes optional markdown fences and strips whitespace."""
     if not isinstance(text, str):
         return ""
-    cleaned = re.sub(r'^\s*```(?:json)?\s*', '', text.strip(), flags=re.IGNORECASE | re.MULTILINE)
-    cleaned = re.sub(r'\s*```\s*$', '', cleaned, flags=re.MULTILINE)
+    # Fast path: both patterns require a fence, so unfenced text only needs stripping
+    if "```" not in text:
+        return text.strip()
+    cleaned = _FENCE_OPEN_RE.sub('', text.strip())
+    cleaned = _FENCE_CLOSE_RE.sub('', cleaned)
     return cleaned.strip()
 
+def body_snippet(body: bytes, limit: int = 500) -> str:
+    """Decodes at most `limit` bytes of a response body, so huge error pages are never fully decoded."""
+    return body[:limit].decode('utf-8', errors='replace')
+
+async def read_stream_head(response: httpx.Response, limit: int = 500) -> bytes:
+    """Reads only the first `limit` bytes of a streamed httpx body; the rest is dropped when the stream closes."""
+    head = b""
+    async for chunk in response.aiter_bytes():
+        head += chunk
+        if len(head) >= limit:
+            break
+    return head[:limit]
+
 def create_error_json(message: str, details: Any = None) -> str:
     """Creates a standardized JSON string for error responses."""
     error_obj: Dict[str, Any] = {"error": message}
@@ -32,7 +191,28 @@ def create_error_json(message: str, details: Any = None) -> str:
         if not isinstance(details, (str, int, float, bool, list, dict, type(None))):
              details = str(details)
         error_obj["details"] = details
-    return json.dumps(error_obj)
+    return msgspec.json.encode(error_obj, enc_hook=str).decode()
+
+def is_error_json(text: str) -> bool:
+    """Cheap check for strings produced by create_error_json ("error" is always the first key)."""
+    return text.startswith('{"error"')
+
+
+class LLMStreamError(Exception):
+    """
+    Raised by AIClient.stream_chat when a provider stream fails. Mirrors create_error_json's fields.
+    stream_only is set when the failure is specific to streaming (endpoint refused it, unparseable events),
+    i.e. when retrying the same request without streaming is worthwhile.
+    """
+
+    def __init__(self, message: str, details: Any = None, stream_only: bool = False):
+        super().__init__(message)
+        self.message = message
+        self.details = details
+        self.stream_only = stream_only
+
+    def to_error_json(self) -> str:
+        return create_error_json(self.message, self.details)
 
 
 class AIClient:
@@ -46,169 +226,299 @@ class AIClient:
         self.lmstudio_model: Optional[str] = settings.lmstudio_model
         self.gemini_model: str = settings.gemini_model
 
+        # Precompute per-provider endpoints and headers once; they only depend on settings
+        gemini_model_name = self.gemini_model if self.gemini_model.startswith("models/") else f"models/{self.gemini_model}"
+        self._gemini_model_name: str = gemini_model_name
+        self._gemini_url: str = f"https://generativelanguage.googleapis.com/v1beta/{gemini_model_name}:generateContent"
+        self._gemini_headers: Optional[Dict[str, str]] = (
+            {**_JSON_HEADERS, "x-goog-api-key": self.gemini_api_key.get_secret_value()} if self.gemini_api_key else None
+        )
+        # Remove trailing slash if present to avoid double slash in URL
+        self._ollama_chat_url: str = f"{self.ollama_url.rstrip('/')}/api/chat"
+        self._lmstudio_chat_url: str = f"{self.lmstudio_url.rstrip('/')}/chat/completions"
+        self._gemini_stream_url: str = f"https://generativelanguage.googleapis.com/v1beta/{gemini_model_name}:streamGenerateContent?alt=sse"
+
+        # Model key -> bound provider method, built once per client
+        self._dispatch: Dict[str, Callable[[str, str], Awaitable[str]]] = {
+            "gemini": self.call_gemini, "ollama": self.call_ollama, "lmstudio": self.call_lmstudio,
+        }
+        self._stream_dispatch: Dict[str, Callable[[str, str], AsyncIterator[str]]] = {
+            "gemini": self._stream_gemini, "ollama": self._stream_ollama, "lmstudio": self._stream_lmstudio,
+        }
+
         if not self.gemini_api_key:
             logger.warning("AIClient initialized: Gemini API key not found. Gemini calls will fail.")
         if not self.lmstudio_model:
             logger.warning("AIClient initialized: LMSTUDIO_MODEL not set. LMStudio calls will fail.")
 
-    # Add return type hint: str (representing raw response or JSON error string)
-    async def call_gemini(self, system_instruction: str, user_prompt: str) -> str:
-            """Calls Gemini API. Returns raw response string or error JSON string."""
-            provider = "Gemini"
-            if not self.gemini_api_key:
-                logger.error(f"{provider}: API key not configured.")
-                return create_error_json(f"{provider} API key not configured")
-    
-            model_name = self.gemini_model
-            if not model_name.startswith("models/"): model_name = f"models/{model_name}"
-            # No need to strip trailing slash here as the URL is constructed differently
-            url = f"https://generativelanguage.googleapis.com/v1beta/{model_name}:generateContent"
-    
-            headers = {"Content-Type": "application/json", "x-goog-api-key": self.gemini_api_key.get_secret_value()}
-            data = {
-                "system_instruction": {"parts": [{"text": system_instruction}]},
-                "contents": [{"role": "user", "parts": [{"text": user_prompt}]}],
-                "generationConfig": {"temperature": 0.4, "topK": 40, "topP": 0.95, "maxOutputTokens": 3500, "response_mime_type": "application/json"}
-            }
-    
+    async def call(self, model: str, system_instruction: str, user_prompt: str) -> str:
+        """Calls the provider for `model` ("gemini", "ollama" or "lmstudio"). Returns raw response string or error JSON string."""
+        call_provider = self._dispatch.get(model)
+        if call_provider is None:
+            logger.error("Invalid model requested: %s", model)
+            return create_error_json(f"Invalid model selected: {model}")
+        return await call_provider(system_instruction, user_prompt)
+
+    async def call_many(self, requests: List[Tuple[str, str, str]]) -> List[str]:
+        """
+        Runs several (model, system_instruction, user_prompt) calls concurrently, so the batch takes as
+        long as its slowest call. Results keep request order; each is a raw response or error JSON string,
+        so one failing call never affects the others. Per-provider concurrency limits still apply.
+        """
+        async def call_one(model: str, system_instruction: str, user_prompt: str) -> str:
             try:
-                async with httpx.AsyncClient() as client:
-                    logger.info(f"Sending request to {provider} API ({model_name})")
-                    response = await client.post(url, headers=headers, json=data, timeout=120.0)
-                    logger.info(f"{provider} API response status: {response.status_code}")
-    
-                    if response.status_code == 200:
-                        try:
-                            result = response.json()
-                            if "candidates" in result and result["candidates"] and "content" in result["candidates"][0] and "parts" in result["candidates"][0]["content"]:
-                                raw_text: str = result["candidates"][0]["content"]["parts"][0]["text"]
-                                logger.info(f"{provider} raw response received (first 100 chars): {raw_text[:100]}...")
-                                return raw_text # Return raw text on success
-                            else:
-                                error_detail = result.get("promptFeedback", result)
-                                logger.error(f"{provider}: Unexpected API response structure or blocked content: {error_detail}")
-                                return create_error_json(f"{provider}: Unexpected API response or blocked content", error_detail)
-                        except json.JSONDecodeError:
-                            logger.error(f"{provider}: Response body was not valid JSON. Status: {response.status_code}, Response: {response.text[:200]}...")
-                            return create_error_json(f"{provider}: Response body was not valid JSON", response.text[:500])
-                        except Exception as e:
-                            logger.exception(f"{provider}: Error processing response JSON: {e}")
-                            return create_error_json(f"{provider}: Error processing response", str(e))
-                    else:
-                        error_text = response.text[:500]
-                        logger.error(f"{provider} API Error: {response.status_code} - {error_text}")
-                        return create_error_json(f"{provider} API Error: {response.status_code}", error_text)
-            except httpx.ReadTimeout:
-                logger.error(f"{provider} API request timed out.")
-                return create_error_json(f"{provider} API request timed out")
-            except httpx.RequestError as e:
-                logger.error(f"{provider}: Network error calling API: {e}")
-                return create_error_json(f"{provider}: Network error", str(e))
+                return await self.call(model, system_instruction, user_prompt)
             except Exception as e:
-                logger.exception(f"{provider}: Unexpected error during API call: {e}")
-                return create_error_json(f"{provider}: Unexpected error", str(e))
-    
+                logger.exception("Unexpected error in batched call to %s: %s", model, e)
+                return create_error_json(f"{model}: Unexpected error", str(e))
+
+        return list(await asyncio.gather(*(call_one(*request) for request in requests)))
+
+    async def aclose(self) -> None:
+        """Releases the pooled HTTP connections shared by all clients."""
+        await close_http_client()
+
+    @_limit_concurrency("gemini")
+    async def call_gemini(self, system_instruction: str, user_prompt: str) -> str:
+        """Calls Gemini API. Returns raw response string or error JSON string."""
+        provider = "Gemini"
+        if self._gemini_headers is None:
+            logger.error("%s: API key not configured.", provider)
+            return create_error_json(f"{provider} API key not configured")
+
+        data = {
+            **_GEMINI_PAYLOAD_TEMPLATE,
+            "system_instruction": {"parts": [{"text": system_instruction}]},
+            "contents": [{"role": "user", "parts": [{"text": user_prompt}]}],
+        }
+        def extract(parsed: _GeminiResponse) -> Optional[str]:
+            if parsed.candidates and parsed.candidates[0].content.parts:
+                return parsed.candidates[0].content.parts[0].text
+            return None
+        # A blocked prompt comes back without candidates; promptFeedback says why
+        return await self._post_httpx(
+            provider, self._gemini_model_name, self._gemini_url, self._gemini_headers, data, 120.0,
+            _GEMINI_RESPONSE_DECODER, extract, "Unexpected API response or blocked content",
+            lambda result: result.get("promptFeedback", result) if isinstance(result, dict) else result,
+        )
+
     # Add return type hint: str
+    @_limit_concurrency("ollama")
     async def call_ollama(self, system_instruction: str, user_prompt: str) -> str:
             """Calls Ollama Chat API. Returns raw response string or error JSON string."""
             provider = "Ollama"
-            # Remove trailing slash if present to avoid double slash in URL
-            base_url = self.ollama_url.rstrip('/')
-            url = f"{base_url}/api/chat" # Use configured URL
+            url = self._ollama_chat_url
             messages = [{"role": "system", "content": system_instruction}, {"role": "user", "content": user_prompt}]
-            data = {"model": self.ollama_model, "messages": messages, "stream": False, "format": "json", "options": {"temperature": 0.4, "top_k": 40, "top_p": 0.95}}
+            data = {**_OLLAMA_PAYLOAD_TEMPLATE, "model": self.ollama_model, "messages": messages}
     
             try:
-                async with aiohttp.ClientSession() as session:
-                    logger.info(f"Sending request to {provider} Chat API ({self.ollama_model}) at URL: {url}")
-                    # Ensure timeout is a suitable type, e.g., aiohttp.ClientTimeout
-                    timeout = aiohttp.ClientTimeout(total=180)
-                    async with session.post(url, json=data, timeout=timeout) as response:
-                        logger.info(f"{provider} API response status: {response.status}")
+                session = get_ollama_session()
+                logger.info("Sending request to %s Chat API (%s) at URL: %s", provider, self.ollama_model, url)
+                async with session.post(url, data=msgspec.json.encode(data), headers=_JSON_HEADERS) as response:
+                    logger.info("%s API response status: %s", provider, response.status)
     
-                        if response.status == 200:
-                            try:
-                                # Specify type hint for result
-                                result: Dict[str, Any] = await response.json(content_type=None) # Ignore content type for flexibility
-                                if "message" in result and "content" in result["message"]:
-                                    raw_response: str = result["message"]["content"]
-                                    logger.info(f"{provider} raw response received (first 100 chars): {raw_response[:100]}...")
-                                    return raw_response # Return raw text on success
-                                else:
-                                    logger.error(f"{provider}: Unexpected chat response structure: {result}")
-                                    return create_error_json(f"{provider}: Unexpected chat response structure", result)
-                            except (json.JSONDecodeError, aiohttp.ContentTypeError): # Catch ContentTypeError too
-                                response_text = await response.text()
-                                logger.error(f"{provider}: Response body was not valid JSON. Status: {response.status}, Response: {response_text[:200]}...")
-                                return create_error_json(f"{provider}: Response body was not valid JSON", response_text[:500])
-                            except Exception as e:
-                                logger.exception(f"{provider}: Error processing response JSON: {e}")
-                                return create_error_json(f"{provider}: Error processing response", str(e))
-                        else:
-                            error_text = await response.text()
-                            logger.error(f"{provider} API Error: {response.status} - {error_text[:500]}")
-                            return create_error_json(f"{provider} API Error: {response.status}", error_text[:500])
+                    if response.status == 200:
+                        try:
+                            # Specify type hint for result
+                            result: Dict[str, Any] = msgspec.json.decode(await response.read()) # Ignore content type for flexibility
+                            if "message" in result and "content" in result["message"]:
+                                raw_response: str = result["message"]["content"]
+                                logger.info("%s raw response received (first 100 chars): %.100s...", provider, raw_response)
+                                return raw_response # Return raw text on success
+                            else:
+                                logger.error("%s: Unexpected chat response structure: %s", provider, result)
+                                return create_error_json(f"{provider}: Unexpected chat response structure", result)
+                        except msgspec.DecodeError:
+                            response_text = body_snippet(await response.read())
+                            logger.error("%s: Response body was not valid JSON. Status: %s, Response: %.200s...", provider, response.status, response_text)
+                            return create_error_json(f"{provider}: Response body was not valid JSON", response_text)
+                        except Exception as e:
+                            logger.exception("%s: Error processing response JSON: %s", provider, e)
+                            return create_error_json(f"{provider}: Error processing response", str(e))
+                    else:
+                        error_text = body_snippet(await response.content.read(500))
+                        logger.error("%s API Error: %s - %s", provider, response.status, error_text)
+                        return create_error_json(f"{provider} API Error: {response.status}", error_text)
             # Remove specific aiohttp.ClientTimeout exception, ClientError is broader
             except aiohttp.ClientError as e: # Catch broader client errors
-                logger.error(f"{provider}: Network/Client error calling API: {e}, URL: {url}")
+                logger.error("%s: Network/Client error calling API: %s, URL: %s", provider, e, url)
                 return create_error_json(f"{provider}: Network error", str(e))
             except Exception as e:
-                logger.exception(f"{provider}: Unexpected error during API call: {e}")
+                logger.exception("%s: Unexpected error during API call: %s", provider, e)
                 return create_error_json(f"{provider}: Unexpected error", str(e))
     
-    # Add return type hint: str
-    # Add type hint for json_schema parameter
+    @_limit_concurrency("lmstudio")
     async def call_lmstudio(self, system_instruction: str, user_prompt: str, json_schema: Optional[Dict[str, Any]] = None) -> str:
-            """Calls LMStudio API. Returns raw response string or error JSON string."""
-            provider = "LMStudio"
-            if not self.lmstudio_model:
-                logger.error(f"{provider}: Model name not configured.")
-                return create_error_json(f"{provider} model not configured")
-    
-            # Remove trailing slash if present to avoid double slash in URL
-            base_url = self.lmstudio_url.rstrip('/')
-            url = f"{base_url}/chat/completions"
-            messages = [{"role": "system", "content": system_instruction}, {"role": "user", "content": user_prompt}]
-            data: Dict[str, Any] = {"model": self.lmstudio_model, "messages": messages, "temperature": 0.4, "max_tokens": 3500, "stream": False}
-            if json_schema:
-                # Ensure the schema structure is correct if provided
-                 data["response_format"] = {"type": "json_object"} # Standard OpenAI JSON mode if schema not directly supported well
-                # Alternative if json_schema type is supported by specific LMStudio version:
-                # data["response_format"] = {"type": "json_schema", "json_schema": {"name": "competitive_analysis", "schema": json_schema}}
-                # Using simple json_object type is generally more compatible.
-    
+        """Calls LMStudio API. Returns raw response string or error JSON string."""
+        provider = "LMStudio"
+        if not self.lmstudio_model:
+            logger.error("%s: Model name not configured.", provider)
+            return create_error_json(f"{provider} model not configured")
+
+        messages = [{"role": "system", "content": system_instruction}, {"role": "user", "content": user_prompt}]
+        data: Dict[str, Any] = {**_LMSTUDIO_PAYLOAD_TEMPLATE, "model": self.lmstudio_model, "messages": messages}
+        if json_schema:
+            # Standard OpenAI JSON mode; more widely supported than passing the schema itself:
+            # data["response_format"] = {"type": "json_schema", "json_schema": {"name": "competitive_analysis", "schema": json_schema}}
+            data["response_format"] = {"type": "json_object"}
+        def extract(parsed: _ChatResponse) -> Optional[str]:
+            return parsed.choices[0].message.content if parsed.choices else None
+        return await self._post_httpx(
+            provider, self.lmstudio_model, self._lmstudio_chat_url, _JSON_HEADERS, data, 180.0,
+            _CHAT_RESPONSE_DECODER, extract, "Unexpected response structure",
+        )
+
+    async def _post_httpx(self, provider: str, model_label: str, url: str, headers: Dict[str, str], data: Dict[str, Any],
+                          timeout: float, decoder: msgspec.json.Decoder, extract: Callable[[Any], Optional[str]],
+                          unexpected_message: str, unexpected_details: Callable[[Any], Any] = lambda result: result) -> str:
+        """
+        Shared POST and error handling for the httpx-based providers (Gemini, LMStudio).
+        `decoder` reads only the success shape and `extract` takes the text from it (None if absent). Any other
+        body is decoded generically and reported as `unexpected_message` with `unexpected_details(result)`.
+        Returns raw response string or error JSON string.
+        """
+        try:
+            client = get_http_client()
+            logger.info("Sending request to %s API (%s)", provider, model_label)
+            response = await client.post(url, headers=headers, content=msgspec.json.encode(data), timeout=timeout)
+            logger.info("%s API response status: %s", provider, response.status_code)
+
+            if response.status_code != 200:
+                error_text = body_snippet(response.content)
+                logger.error("%s API Error: %s - %s", provider, response.status_code, error_text)
+                return create_error_json(f"{provider} API Error: {response.status_code}", error_text)
             try:
-                async with httpx.AsyncClient() as client:
-                    logger.info(f"Sending request to {provider} API ({self.lmstudio_model})")
-                    response = await client.post(url, json=data, timeout=180.0)
-                    logger.info(f"{provider} API response status: {response.status_code}")
-    
-                    if response.status_code == 200:
-                        try:
-                            result = response.json()
-                            if "choices" in result and result["choices"] and "message" in result["choices"][0] and "content" in result["choices"][0]["message"]:
-                                raw_response: str = result["choices"][0]["message"]["content"]
-                                logger.info(f"{provider} raw response received (first 100 chars): {raw_response[:100]}...")
-                                return raw_response # Return raw text on success
-                            else:
-                                logger.error(f"{provider}: Unexpected response structure: {result}")
-                                return create_error_json(f"{provider}: Unexpected response structure", result)
-                        except json.JSONDecodeError:
-                            logger.error(f"{provider}: Response body was not valid JSON. Status: {response.status_code}, Response: {response.text[:200]}...")
-                            return create_error_json(f"{provider}: Response body was not valid JSON", response.text[:500])
-                        except Exception as e:
-                             logger.exception(f"{provider}: Error processing response JSON: {e}")
-                             return create_error_json(f"{provider}: Error processing response", str(e))
-                    else:
-                        error_text = response.text[:500]
-                        logger.error(f"{provider} API Error: {response.status_code} - {error_text}")
-                        return create_error_json(f"{provider} API Error: {response.status_code}", error_text)
-            except httpx.ReadTimeout:
-                logger.error(f"{provider} API request timed out.")
-                return create_error_json(f"{provider} API request timed out")
-            except httpx.RequestError as e:
-                logger.error(f"{provider}: Network error calling API: {e}")
-                return create_error_json(f"{provider}: Network error", str(e))
+                try:
+                    raw_text = extract(decoder.decode(response.content))
+                except msgspec.ValidationError:
+                    raw_text = None # Valid JSON, unexpected shape: reported below
+                if raw_text is not None:
+                    logger.info("%s raw response received (first 100 chars): %.100s...", provider, raw_text)
+                    return raw_text # Return raw text on success
+                details = unexpected_details(msgspec.json.decode(response.content))
+                logger.error("%s: %s: %s", provider, unexpected_message, details)
+                return create_error_json(f"{provider}: {unexpected_message}", details)
+            except msgspec.DecodeError:
+                error_text = body_snippet(response.content)
+                logger.error("%s: Response body was not valid JSON. Status: %s, Response: %.200s...", provider, response.status_code, error_text)
+                return create_error_json(f"{provider}: Response body was not valid JSON", error_text)
             except Exception as e:
-                logger.exception(f"{provider}: Unexpected error during API call: {e}")
-                return create_error_json(f"{provider}: Unexpected error", str(e))
\ No newline at end of file
+                logger.exception("%s: Error processing response JSON: %s", provider, e)
+                return create_error_json(f"{provider}: Error processing response", str(e))
+        except httpx.ReadTimeout:
+            logger.error("%s API request timed out.", provider)
+            return create_error_json(f"{provider} API request timed out")
+        except httpx.RequestError as e:
+            logger.error("%s: Network error calling API: %s", provider, e)
+            return create_error_json(f"{provider}: Network error", str(e))
+        except Exception as e:
+            logger.exception("%s: Unexpected error during API call: %s", provider, e)
+            return create_error_json(f"{provider}: Unexpected error", str(e))
+
+    # --- Streaming ---
+
+    async def stream_chat(self, model: str, system_instruction: str, user_prompt: str) -> AsyncIterator[str]:
+        """
+        Streams the response text from the selected provider as it is generated.
+        Yields text deltas; raises LLMStreamError if the provider cannot be reached or returns an error.
+        """
+        streamer = self._stream_dispatch.get(model)
+        if streamer is None:
+            raise LLMStreamError(f"Invalid model selected for streaming: {model}")
+        async with get_provider_semaphore(model):
+            async for chunk in streamer(system_instruction, user_prompt):
+                yield chunk
+
+    async def _stream_httpx_sse(self, provider: str, url: str, headers: Dict[str, str], data: Dict[str, Any],
+                                extract: Callable[[Dict[str, Any]], Optional[str]], timeout: float) -> AsyncIterator[str]:
+        """Shared SSE reader for the httpx-based providers (Gemini, LMStudio)."""
+        try:
+            client = get_http_client()
+            logger.info("Opening %s stream", provider)
+            async with client.stream("POST", url, headers=headers, content=msgspec.json.encode(data), timeout=timeout) as response:
+                if response.status_code != 200:
+                    error_text = body_snippet(await read_stream_head(response))
+                    logger.error("%s API Error: %s - %s", provider, response.status_code, error_text)
+                    raise LLMStreamError(f"{provider} API Error: {response.status_code}", error_text,
+                                         stream_only=response.status_code in _STREAM_UNSUPPORTED_STATUSES)
+                async for line in response.aiter_lines():
+                    if not line.startswith(_SSE_DATA_PREFIX):
+                        continue
+                    payload = line[len(_SSE_DATA_PREFIX):].strip()
+                    if payload == "[DONE]":
+                        break
+                    try:
+                        text = extract(msgspec.json.decode(payload))
+                    except (msgspec.DecodeError, KeyError, IndexError, TypeError, AttributeError) as e: # e.g. a non-object event
+                        raise LLMStreamError(f"{provider}: Unexpected stream event", str(e), stream_only=True)
+                    if text:
+                        yield text
+        except httpx.ReadTimeout:
+            logger.error("%s API stream timed out.", provider)
+            raise LLMStreamError(f"{provider} API request timed out")
+        except httpx.RequestError as e:
+            logger.error("%s: Network error streaming API: %s", provider, e)
+            raise LLMStreamError(f"{provider}: Network error", str(e))
+
+    async def _stream_gemini(self, system_instruction: str, user_prompt: str) -> AsyncIterator[str]:
+        if self._gemini_headers is None:
+            raise LLMStreamError("Gemini API key not configured")
+        data = {
+            **_GEMINI_PAYLOAD_TEMPLATE,
+            "system_instruction": {"parts": [{"text": system_instruction}]},
+            "contents": [{"role": "user", "parts": [{"text": user_prompt}]}],
+        }
+        def extract(event: Dict[str, Any]) -> Optional[str]:
+            candidates = event.get("candidates")
+            if not candidates:
+                return None
+            parts = candidates[0].get("content", {}).get("parts", [])
+            return "".join(part.get("text", "") for part in parts)
+        async for chunk in self._stream_httpx_sse("Gemini", self._gemini_stream_url, self._gemini_headers, data, extract, 120.0):
+            yield chunk
+
+    async def _stream_lmstudio(self, system_instruction: str, user_prompt: str) -> AsyncIterator[str]:
+        if not self.lmstudio_model:
+            raise LLMStreamError("LMStudio model not configured")
+        messages = [{"role": "system", "content": system_instruction}, {"role": "user", "content": user_prompt}]
+        data = {**_LMSTUDIO_PAYLOAD_TEMPLATE, "model": self.lmstudio_model, "messages": messages, "stream": True}
+        def extract(event: Dict[str, Any]) -> Optional[str]:
+            choices = event.get("choices")
+            if not choices:
+                return None
+            content: Optional[str] = choices[0].get("delta", {}).get("content")
+            return content
+        async for chunk in self._stream_httpx_sse("LMStudio", self._lmstudio_chat_url, _JSON_HEADERS, data, extract, 180.0):
+            yield chunk
+
+    async def _stream_ollama(self, system_instruction: str, user_prompt: str) -> AsyncIterator[str]:
+        """Ollama streams newline-delimited JSON objects rather than SSE."""
+        provider = "Ollama"
+        messages = [{"role": "system", "content": system_instruction}, {"role": "user", "content": user_prompt}]
+        data = {**_OLLAMA_PAYLOAD_TEMPLATE, "model": self.ollama_model, "messages": messages, "stream": True}
+        try:
+            session = get_ollama_session()
+            logger.info("Opening %s stream at URL: %s", provider, self._ollama_chat_url)
+            async with session.post(self._ollama_chat_url, data=msgspec.json.encode(data), headers=_JSON_HEADERS) as response:
+                if response.status != 200:
+                    error_text = body_snippet(await response.content.read(500))
+                    logger.error("%s API Error: %s - %s", provider, response.status, error_text)
+                    raise LLMStreamError(f"{provider} API Error: {response.status}", error_text,
+                                         stream_only=response.status in _STREAM_UNSUPPORTED_STATUSES)
+                async for line in response.content:
+                    if not line.strip():
+                        continue
+                    try:
+                        event = msgspec.json.decode(line)
+                    except msgspec.DecodeError as e:
+                        raise LLMStreamError(f"{provider}: Unexpected stream event", str(e), stream_only=True)
+                    if "error" in event:
+                        raise LLMStreamError(f"{provider}: Stream error", event["error"])
+                    text = event.get("message", {}).get("content")
+                    if text:
+                        yield text
+                    if event.get("done"):
+                        break
+        except aiohttp.ClientError as e:
+            logger.error("%s: Network/Client error streaming API: %s, URL: %s", provider, e, self._ollama_chat_url)
+            raise LLMStreamError(f"{provider}: Network error", str(e))
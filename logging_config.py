@@ -0,0 +1,69 @@
+# ---- File: logging_config.py ----
+
+import atexit
+import logging
+import logging.handlers
+import queue
+from collections import deque
+from typing import Deque, List, Optional
+
+# Import the global settings instance
+from config import settings
+
+LOG_FORMAT = '%(levelname).1s %(asctime)s.%(msecs)03d [%(filename)s:%(lineno)d] %(message)s'
+LOG_DATEFMT = '%H:%M:%S'
+
+
+class RingBufferHandler(logging.Handler):
+    """Keeps the most recent log records in memory for post-mortem inspection.
+
+    Records are stored unformatted, so the cost is only paid when `dump()` is called.
+    """
+
+    def __init__(self, capacity: int = 500, level: int = logging.INFO):
+        super().__init__(level)
+        self.records: Deque[logging.LogRecord] = deque(maxlen=capacity)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.records.append(record)
+
+    def dump(self) -> List[str]:
+        """Returns the buffered records formatted with the standard log format."""
+        formatter = self.formatter or logging.Formatter(LOG_FORMAT, LOG_DATEFMT)
+        return [formatter.format(record) for record in list(self.records)]
+
+
+ring_buffer = RingBufferHandler(capacity=settings.log_ring_buffer_size)
+
+# Writes console output on a background thread; request handlers only enqueue the record
+_console_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def configure_logging() -> None:
+    """Configures root logging once: console output at LOG_LEVEL (written off-thread), INFO and above into the ring buffer."""
+    root = logging.getLogger()
+    if ring_buffer in root.handlers:
+        return  # Already configured
+
+    console_level = logging.getLevelName(settings.log_level.upper())
+    if not isinstance(console_level, int):
+        console_level = logging.INFO
+
+    console = logging.StreamHandler()
+    console.setLevel(console_level)
+    console.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATEFMT))
+
+    # stderr writes can block the event loop under load, so they go through a queue drained by a
+    # listener thread. The QueueHandler's level keeps records below LOG_LEVEL from being enqueued.
+    global _console_listener
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.setLevel(console_level)
+    _console_listener = logging.handlers.QueueListener(log_queue, console, respect_handler_level=True)
+    _console_listener.start()
+    atexit.register(_console_listener.stop) # Flushes queued records on interpreter exit
+
+    root.addHandler(queue_handler)
+    root.addHandler(ring_buffer)
+    # Root must let through whatever either handler wants
+    root.setLevel(min(console_level, ring_buffer.level))
@@ -1,6 +1,6 @@
 # ---- File: main.py ----
 
-from fasthtml.common import fast_app, Div, H3, P
+from fasthtml.common import fast_app, Div, H3, P, Script
 # Import necessary types for exception handlers
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.responses import HTMLResponse, RedirectResponse
@@ -9,11 +9,14 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from starlette.exceptions import HTTPException as StarletteHTTPException
 
-from starlette.middleware.sessions import SessionMiddleware # Import middleware directly for options
-from auth import add_auth_routes
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from auth import add_auth_routes, close_oauth_client
 from dashboard import add_dashboard_routes
 from analysis import add_analysis_routes, render_model_selection_oob # Import helper
-from utils import get_user
+from utils import get_user, static_url
+from llm_client import close_http_client
 import uvicorn
 import logging
 import traceback # For logging stack traces
@@ -22,31 +25,61 @@ import os # Import os for path joining
 
 # Import the global settings instance
 from config import settings
+from logging_config import configure_logging
 
-# Setup basic logging configuration
-# Consider using FastAPI's logging integration for more advanced setups later
-logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)s] [%(filename)s:%(lineno)d] %(message)s')
+# Setup logging (console level from LOG_LEVEL, recent records kept in an in-memory ring buffer)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Initialize FastHTML app
+# Sessions: fast_app's own SessionMiddleware is the single one, configured with our secure options.
+# (A second, manually added SessionMiddleware used to sit outside it, so every request unsigned two
+# cookies and every response signed two; only fast_app's session ever reached the handlers.)
+# Note: sess_https_only=True requires HTTPS. 'lax' same_site is a good default, 'strict' is more
+# secure but can break some cross-site workflows.
 app, rt = fast_app(
-    # with_session=False, # Don't let fast_app add default session middleware
-    # secret_key=settings.session_secret_key.get_secret_value()
-)
-
-# --- Add Session Middleware Manually with Secure Options ---
-# Note: 'secure=True' requires HTTPS. Set https_only=True for stricter enforcement.
-# 'samesite'='lax' is a good default, 'strict' is more secure but can break some cross-site workflows.
-app.add_middleware(
-    SessionMiddleware,
     secret_key=settings.session_secret_key.get_secret_value(),
-    session_cookie="session", # Default cookie name
-    max_age=14 * 24 * 60 * 60,  # Example: 14 days expiration
-    same_site="lax", # Good default: 'strict', 'lax', or 'none'
-    https_only=False # Set to True ONLY if served over HTTPS
-    # secure=True # Deprecated in favour of https_only - DO NOT USE BOTH WITH https_only=True
+    session_cookie="session",
+    max_age=14 * 24 * 60 * 60,  # 14 days expiration
+    same_site="lax",
+    sess_https_only=False, # Set to True ONLY if served over HTTPS
+    # htmx SSE extension: analysis results are pushed over /analyze-stream instead of polled
+    hdrs=(Script(src="https://unpkg.com/htmx-ext-sse@2.2.2/sse.js"),),
 )
 
+# Release pooled LLM provider and OAuth connections when the server stops
+app.add_event_handler("shutdown", close_http_client)
+app.add_event_handler("shutdown", close_oauth_client)
+
+# --- Response Compression ---
+# Result panels and the dashboard are repetitive HTML that gzips well; from ~500 bytes the class
+# strings already shrink several-fold. Tiny fragments (OOB radios, 401s) are sent as-is; Starlette
+# never compresses text/event-stream, so the SSE analysis stream is unaffected. (Brotli would need
+# an extra dependency whose middleware has no such SSE exclusion, so gzip stays the only encoding.)
+app.add_middleware(GZipMiddleware, minimum_size=500, compresslevel=6)
+
+# --- Long-lived caching for versioned static files ---
+class ImmutableStaticMiddleware:
+    """Marks content-hashed static URLs (/static/...?v=<hash>, see utils.static_url) as cacheable
+    forever, so repeat visits don't even revalidate the stylesheet. Unversioned URLs are untouched."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not scope["path"].startswith("/static/") or b"v=" not in scope["query_string"]:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cache_control(message: Message) -> None:
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                MutableHeaders(scope=message)["Cache-Control"] = "public, max-age=31536000, immutable"
+            await send(message)
+
+        await self.app(scope, receive, send_with_cache_control)
+
+app.add_middleware(ImmutableStaticMiddleware)
+
 # --- Mount Static Files Directory ---
 # Determine the path to the static directory relative to this file
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -66,6 +99,7 @@ if not os.path.isdir(TEMPLATES_DIR):
     os.makedirs(TEMPLATES_DIR, exist_ok=True)
 
 templates = Jinja2Templates(directory=TEMPLATES_DIR)
+templates.env.globals["static_url"] = static_url
 logger.info(f"Configured templates directory at {TEMPLATES_DIR}")
 
 
@@ -181,8 +215,8 @@ async def test_404(r: Request) -> None:
 
 # --- Route Registration ---
 add_auth_routes(rt)
-add_dashboard_routes(rt, get_user)
-add_analysis_routes(rt, get_user)
+add_dashboard_routes(rt, app.hdrs)
+add_analysis_routes(rt)
 
 # --- Catch-all route for 404 errors ---
 @app.exception_handler(404)
@@ -205,6 +239,7 @@ def serve():
     # Check for session key warning again just before serving
     if settings.session_secret_key.get_secret_value() == "default-insecure-secret-key-replace-me":
         logger.warning("SECURITY WARNING: Using default SESSION_SECRET_KEY. Server started but sessions are insecure.")
+    # uvicorn already uses uvloop and httptools (from uvicorn[standard]) when they are installed
     uvicorn.run(
         "main:app", # Use string syntax for reload compatibility
         host=settings.app_host,
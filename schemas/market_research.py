@@ -1,7 +1,11 @@
 # ---- File: schemas/market_research.py ----
 
+import json
+from pathlib import Path
+
+import msgspec
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Tuple, cast
 
 # --- Pydantic Models for Market Research Agent ---
 
@@ -38,4 +42,54 @@ class CompetitiveAnalysis(BaseModel):
                 }
             ]
         }
-    }
\ No newline at end of file
+    }
+
+
+# --- msgspec Structs for fast response decoding ---
+# Mirror the Pydantic models above field for field. Used on the hot path to decode and
+# validate LLM output; the Pydantic models remain the source of the prompt JSON schema
+# and of detailed validation errors.
+
+class CompetitorInfoStruct(msgspec.Struct, kw_only=True):
+    name: str
+    strengths: List[str]
+    weaknesses: List[str]
+    market_share: Optional[str] = None
+    key_features: List[str]
+    pricing: Optional[str] = None
+
+class MarketTrendStruct(msgspec.Struct, kw_only=True):
+    trend: str
+    impact: str
+    opportunity: Optional[str] = None
+    threat: Optional[str] = None
+
+class CompetitiveAnalysisStruct(msgspec.Struct, kw_only=True):
+    competitors: List[CompetitorInfoStruct]
+    market_trends: List[MarketTrendStruct]
+    recommendations: List[str]
+    summary: str
+
+
+# --- Pre-dumped prompt schema ---
+# Building the JSON schema through Pydantic costs noticeable import time on cold starts, so the
+# agent reads these checked-in dumps instead. Regenerate after changing the models above:
+#   python -m schemas.market_research
+SCHEMA_FILE = Path(__file__).with_name("competitive_analysis.schema.json")
+EXAMPLE_FILE = Path(__file__).with_name("competitive_analysis.example.json")
+
+def dump_competitive_analysis_schema() -> Tuple[str, str]:
+    """Generates the (schema, example) JSON strings embedded in the agent prompt."""
+    # json_schema_extra is declared as a dict on CompetitiveAnalysis (Pydantic also allows a callable)
+    schema_extra = cast(Dict[str, Any], CompetitiveAnalysis.model_config.get("json_schema_extra") or {})
+    examples = schema_extra.get("examples", [{}])
+    schema_json_str = json.dumps(CompetitiveAnalysis.model_json_schema(), indent=2)
+    example_json_str = json.dumps(examples[0] if examples else {}, indent=2)
+    return schema_json_str, example_json_str
+
+
+if __name__ == "__main__":
+    schema_json_str, example_json_str = dump_competitive_analysis_schema()
+    SCHEMA_FILE.write_text(schema_json_str + "\n", encoding="utf-8")
+    EXAMPLE_FILE.write_text(example_json_str + "\n", encoding="utf-8")
+    print(f"Wrote {SCHEMA_FILE} and {EXAMPLE_FILE}")
@@ -0,0 +1,94 @@
+# ---- File: semantic_cache.py ----
+
+import asyncio
+import logging
+from typing import Any, Dict, Optional, cast
+
+import msgspec
+
+# Import the global settings instance
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# --- Redis Semantic Cache ---
+# Optional tier in front of the LLM: paraphrased queries ("competitors for Notion" vs
+# "who competes with Notion") are answered from Redis instead of a new LLM round-trip.
+# Needs `redisvl` (plus `sentence-transformers` for the default vectorizer) and a Redis Stack
+# server; disabled unless SEMANTIC_CACHE_ENABLED=true. Any cache failure is treated as a miss.
+_semantic_cache: Any = None
+_semantic_cache_unavailable = False
+# Serializes the first build so concurrent requests don't each load the embedding model
+_semantic_cache_lock = asyncio.Lock()
+
+
+def _build_semantic_cache() -> Any:
+    """Connects to Redis and loads the vectorizer (blocking: network I/O and model load)."""
+    from redisvl.extensions.cache.embeddings import EmbeddingsCache
+    from redisvl.extensions.cache.llm import SemanticCache
+    from redisvl.utils.vectorize import HFTextVectorizer
+
+    redis_url = f"redis://{settings.redis_host}:{settings.redis_port}/{settings.redis_db}"
+    # Embedding the query is the slow part of a lookup; the vectorizer checks this (text -> vector)
+    # cache first, so a repeated query (e.g. same text, other model) skips the encoder entirely
+    embeddings_cache = EmbeddingsCache(
+        name="pm_embeddings",
+        redis_url=redis_url,
+        ttl=settings.semantic_cache_embedding_ttl_seconds,
+    )
+    return SemanticCache(
+        name="pm_analysis",
+        redis_url=redis_url,
+        distance_threshold=settings.semantic_cache_distance_threshold,
+        ttl=settings.semantic_cache_ttl_seconds,
+        vectorizer=HFTextVectorizer(model=settings.semantic_cache_embedding_model, cache=embeddings_cache),
+        # Tag field so per-model isolation is filtered inside the Redis KNN query
+        filterable_fields=[{"name": "model", "type": "tag"}],
+    )
+
+
+async def get_semantic_cache() -> Any:
+    """Returns the shared RedisVL SemanticCache, or None if disabled or unavailable.
+    The first call builds it in a worker thread so the event loop keeps serving requests."""
+    global _semantic_cache, _semantic_cache_unavailable
+    if _semantic_cache is not None or _semantic_cache_unavailable or not settings.semantic_cache_enabled:
+        return _semantic_cache
+    async with _semantic_cache_lock:
+        if _semantic_cache is not None or _semantic_cache_unavailable:
+            return _semantic_cache
+        try:
+            _semantic_cache = await asyncio.to_thread(_build_semantic_cache)
+            logger.info("Semantic cache enabled (index 'pm_analysis').")
+        except Exception as e:
+            # Don't retry on every request; the app works without the cache
+            _semantic_cache_unavailable = True
+            logger.warning("Semantic cache disabled, could not initialize RedisVL: %s", e)
+    return _semantic_cache
+
+
+async def lookup(query: str, model: str) -> Optional[Dict[str, Any]]:
+    """Returns a cached analysis result for a semantically similar query on the same model, if any."""
+    cache = await get_semantic_cache()
+    if cache is None:
+        return None
+    try:
+        from redisvl.query.filter import Tag
+
+        hits = await cache.acheck(prompt=query, num_results=1, filter_expression=Tag("model") == model)
+        if hits:
+            logger.info("Semantic cache hit for model %s.", model)
+            return cast(Dict[str, Any], msgspec.json.decode(hits[0]["response"]))
+    except Exception as e:
+        logger.warning("Semantic cache lookup failed, treating as a miss: %s", e)
+    return None
+
+
+async def store(query: str, model: str, result: Dict[str, Any]) -> None:
+    """Stores a successful (structured) analysis result. Errors are never cached."""
+    cache = await get_semantic_cache()
+    if cache is None or "structured" not in result:
+        return
+    try:
+        await cache.astore(prompt=query, response=msgspec.json.encode(result).decode(), filters={"model": model})
+    except Exception as e:
+        logger.warning("Semantic cache store failed: %s", e)
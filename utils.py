@@ -1,7 +1,14 @@
 # ---- File: utils.py ----
 
+import functools
+import hashlib
+import os
 from fastapi import HTTPException
 from starlette.requests import Request
+from starlette.responses import Response
+from typing import Optional
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
 
 async def get_user(r: Request):
     """Check if the user is authenticated."""
@@ -13,4 +20,23 @@ async def get_user(r: Request):
         raise HTTPException(status_code=307, detail="Not authenticated", headers={'Location': '/login'})
     return email
 
+def session_user(r: Request) -> Optional[str]:
+    """Returns the logged-in user's email straight from the session (no dependency resolution), or None."""
+    return r.session.get('user_email') or None
+
+def unauthorized_response() -> Response:
+    """401 for HTMX requests from a logged-out browser; HX-Redirect sends the page to the login screen."""
+    return Response(status_code=401, headers={'HX-Redirect': '/login'})
+
+@functools.lru_cache(maxsize=None)
+def static_url(filename: str) -> str:
+    """URL for a file in static/ with a content hash (?v=...). The hash changes whenever the file does,
+    so browsers may cache the URL forever (see the immutable Cache-Control set in main.py)."""
+    try:
+        with open(os.path.join(STATIC_DIR, filename), "rb") as f:
+            version = hashlib.blake2b(f.read(), digest_size=4).hexdigest()
+    except OSError:
+        return f"/static/{filename}"
+    return f"/static/{filename}?v={version}"
+
 # SP variable removed - System prompt is now centralized in ai_agent.py
\ No newline at end of file